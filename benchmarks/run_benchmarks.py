@@ -0,0 +1,365 @@
+"""
+Benchmarks for the feature extraction and model training hot paths.
+
+For each requested scale, synthetic games are generated (see benchmarks/synthetic_games.py) and every benchmark
+in BENCHMARKS is run on them in a fresh process, so that one benchmark isn't affected by the ones before it.
+Each benchmark does its own (untimed) setup, imports included, and then times a single operation. Its memory
+cost is the peak RSS while the operation runs (sampled every RSS_SAMPLE_SECONDS), minus the RSS before it, so
+that the memory taken by setup isn't counted. The results, with wall time, rows/sec and RSS delta, are written to
+a JSON file named after the current commit:
+
+    python -m benchmarks.run_benchmarks --rows 20000 1000000
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+
+Model benchmarks train on at most --max-train-rows games, since a 100-tree random forest on 10M rows takes hours.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from src.profiling import rss_mb
+
+RESULTS_DIR = "./benchmarks/results"
+DEFAULT_ROWS = [20_000, 1_000_000, 10_000_000]
+MAX_TRAIN_ROWS = 1_000_000
+RSS_SAMPLE_SECONDS = 0.005
+
+
+class Timer:
+    seconds = None
+    rss_delta_mb = None
+
+
+@contextmanager
+def timed():
+    # Times the block, while a thread samples the RSS to find its peak over the block
+    timer = Timer()
+    rss_before = rss_mb()
+    peak = [rss_before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    if rss_before is not None:
+        sampler.start()
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - start
+        done.set()
+
+    if rss_before is not None:
+        sampler.join()
+        timer.rss_delta_mb = max(peak[0], rss_mb()) - rss_before
+
+
+def _raw_games(raw_path):
+    from src.loading import load_raw_games
+
+    return load_raw_games(raw_path)
+
+
+def _eco_vocabularies(df):
+    from scripts.position_analysis import CUTOFF
+    from src.features import fit_eco_vocabulary
+
+    eco_counts = df["opening_eco"].value_counts()
+    return {chars: fit_eco_vocabulary(eco_counts, chars, CUTOFF) for chars in (1, 2, 3)}
+
+
+def _design_matrix(raw_path):
+    from scripts.extract_features import extract_features
+
+    df = _raw_games(raw_path)
+    return extract_features(df, _eco_vocabularies(df))
+
+
+def _model_inputs(raw_path, max_train_rows):
+    from sklearn.model_selection import train_test_split
+
+    design_matrix = _design_matrix(raw_path)
+    design_matrix = design_matrix.iloc[: int(max_train_rows / 0.8)]
+    X = design_matrix.drop(columns=["outcome", "is_draw"])
+    return train_test_split(X, design_matrix["outcome"], test_size=0.2, random_state=13)
+
+
+def bench_load_csv(raw_path, workdir, max_train_rows):
+    # Imported up front, so importing pandas isn't timed along with the load
+    from src.loading import load_raw_games
+
+    with timed() as timer:
+        df = load_raw_games(raw_path)
+    return len(df), timer
+
+
+def bench_add_game_outcome_column(raw_path, workdir, max_train_rows):
+    from src.features import add_game_outcome_column
+
+    df = _raw_games(raw_path)
+    with timed() as timer:
+        add_game_outcome_column(df)
+    return len(df), timer
+
+
+def bench_add_time_component_columns(raw_path, workdir, max_train_rows):
+    from src.features import add_time_component_columns
+
+    df = _raw_games(raw_path)
+    with timed() as timer:
+        add_time_component_columns(df)
+    return len(df), timer
+
+
+def bench_add_game_duration_column(raw_path, workdir, max_train_rows):
+    from src.features import add_game_duration_column
+
+    df = _raw_games(raw_path)
+    with timed() as timer:
+        add_game_duration_column(df)
+    return len(df), timer
+
+
+def bench_add_approx_time_limit_column(raw_path, workdir, max_train_rows):
+    from src.features import add_approx_time_limit_column
+
+    df = _raw_games(raw_path)
+    with timed() as timer:
+        add_approx_time_limit_column(df, 60)
+    return len(df), timer
+
+
+def bench_add_one_hot_eco_columns(raw_path, workdir, max_train_rows):
+    from scripts.position_analysis import CUTOFF
+    from src.features import add_one_hot_encoding_for_truncated_eco_code
+
+    df = _raw_games(raw_path)
+    eco_vocabularies = _eco_vocabularies(df)
+    with timed() as timer:
+        for chars, vocabulary in eco_vocabularies.items():
+            df = add_one_hot_encoding_for_truncated_eco_code(
+                df, chars, CUTOFF, vocabulary
+            )
+    return len(df), timer
+
+
+def bench_add_eco_code_columns(raw_path, workdir, max_train_rows):
+    from src.features import add_eco_code_column
+
+    df = _raw_games(raw_path)
+    eco_vocabularies = _eco_vocabularies(df)
+    with timed() as timer:
+        for chars, vocabulary in eco_vocabularies.items():
+            df = add_eco_code_column(df, chars, vocabulary)
+    return len(df), timer
+
+
+def bench_feature_pipeline_transform_record(raw_path, workdir, max_train_rows):
+    # One game at a time, as the prediction server featurizes them
+    from scripts.duration_analysis import MAX_GAME_TIME_LIMIT_MINUTES
+    from src.pipeline import FeaturePipeline
+
+    df = _raw_games(raw_path)
+    pipeline = FeaturePipeline(_eco_vocabularies(df), MAX_GAME_TIME_LIMIT_MINUTES)
+    records = df.to_dict("records")
+    with timed() as timer:
+        for record in records:
+            pipeline.transform_record(record)
+    return len(records), timer
+
+
+def bench_extract_features(raw_path, workdir, max_train_rows):
+    from scripts.extract_features import CHUNK_SIZE, main
+
+    output_path = os.path.join(workdir, "processed.csv")
+    vocabulary_path = os.path.join(workdir, "eco_vocabulary.json")
+    with timed() as timer:
+        main(raw_path, output_path, CHUNK_SIZE, vocabulary_path, False, "one-hot")
+    return sum(1 for _ in open(raw_path)) - 1, timer
+
+
+def bench_save_csv(raw_path, workdir, max_train_rows):
+    design_matrix = _design_matrix(raw_path)
+    with timed() as timer:
+        design_matrix.to_csv(os.path.join(workdir, "processed.csv"), index=False)
+    return len(design_matrix), timer
+
+
+def bench_save_parquet(raw_path, workdir, max_train_rows):
+    from src.design_matrix import DesignMatrixWriter
+
+    design_matrix = _design_matrix(raw_path)
+    with timed() as timer:
+        with DesignMatrixWriter(os.path.join(workdir, "processed.parquet")) as writer:
+            writer.write(design_matrix)
+    return len(design_matrix), timer
+
+
+def _bench_model(model, raw_path, max_train_rows, stage):
+    X_train, X_test, y_train, y_test = _model_inputs(raw_path, max_train_rows)
+    with timed() as fit_timer:
+        model.fit(X_train, y_train)
+    if stage == "fit":
+        return len(X_train), fit_timer
+
+    with timed() as predict_timer:
+        model.predict(X_test)
+    return len(X_test), predict_timer
+
+
+def _random_forest():
+    from sklearn.ensemble import RandomForestClassifier
+
+    return RandomForestClassifier(n_estimators=100, random_state=42)
+
+
+def _logistic_regression():
+    from sklearn.linear_model import LogisticRegression
+
+    return LogisticRegression(max_iter=1000)
+
+
+def bench_random_forest_fit(raw_path, workdir, max_train_rows):
+    return _bench_model(_random_forest(), raw_path, max_train_rows, "fit")
+
+
+def bench_random_forest_predict(raw_path, workdir, max_train_rows):
+    return _bench_model(_random_forest(), raw_path, max_train_rows, "predict")
+
+
+def bench_logistic_regression_fit(raw_path, workdir, max_train_rows):
+    return _bench_model(_logistic_regression(), raw_path, max_train_rows, "fit")
+
+
+def bench_logistic_regression_predict(raw_path, workdir, max_train_rows):
+    return _bench_model(_logistic_regression(), raw_path, max_train_rows, "predict")
+
+
+BENCHMARKS = {
+    name[len("bench_") :]: function
+    for name, function in globals().items()
+    if name.startswith("bench_")
+}
+
+
+def _run_in_child(name, raw_path, workdir, max_train_rows):
+    rows, timer = BENCHMARKS[name](raw_path, workdir, max_train_rows)
+    return {
+        "rows": rows,
+        "wall_seconds": timer.seconds,
+        "rows_per_second": rows / timer.seconds if timer.seconds else None,
+        "rss_delta_mb": timer.rss_delta_mb,
+    }
+
+
+def run_benchmark(name, raw_path, workdir, max_train_rows):
+    # A fresh interpreter per benchmark, so nothing is left over from the ones before
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(_run_in_child, (name, raw_path, workdir, max_train_rows))
+
+
+def _current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(scales, names, max_train_rows, output_path):
+    from benchmarks.synthetic_games import generate_games
+
+    report = {
+        "commit": _current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "results": [],
+    }
+    for rows in scales:
+        with tempfile.TemporaryDirectory() as workdir:
+            raw_path = os.path.join(workdir, "chess_games.csv")
+            generate_games(raw_path, rows)
+
+            for name in names:
+                result = {"benchmark": name, "scale": rows}
+                result.update(run_benchmark(name, raw_path, workdir, max_train_rows))
+                report["results"].append(result)
+                print(
+                    f"{name:35s} {rows:>10d} rows: {result['wall_seconds']:9.3f}s "
+                    f"{_format_mb(result['rss_delta_mb'])} RSS delta"
+                )
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output_path}")
+
+
+def _format_mb(mb):
+    return f"{'n/a':>9s}" if mb is None else f"{mb:+9.1f} MB"
+
+
+def compare_reports(baseline_path, candidate_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    baseline_results = {(r["benchmark"], r["scale"]): r for r in baseline["results"]}
+    # RSS deltas can be close to 0, so are compared as a difference rather than a ratio
+    print(
+        f"{'benchmark':35s} {'scale':>10s} {'time':>8s} "
+        f"{'RSS delta before':>19s} {'after':>12s}"
+    )
+    for result in candidate["results"]:
+        before = baseline_results.get((result["benchmark"], result["scale"]))
+        if before is None:
+            continue
+        time_ratio = result["wall_seconds"] / before["wall_seconds"]
+        print(
+            f"{result['benchmark']:35s} {result['scale']:>10d} {time_ratio:7.2f}x "
+            f"{_format_mb(before.get('rss_delta_mb')):>19s} "
+            f"{_format_mb(result.get('rss_delta_mb')):>12s}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS)
+    )
+    parser.add_argument("--max-train-rows", type=int, default=MAX_TRAIN_ROWS)
+    parser.add_argument("--output")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CANDIDATE"),
+        help="print time and memory ratios between two results files instead",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+    else:
+        output_path = args.output or os.path.join(
+            RESULTS_DIR, f"{_current_commit()}.json"
+        )
+        run_benchmarks(args.rows, args.benchmarks, args.max_train_rows, output_path)
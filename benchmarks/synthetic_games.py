@@ -0,0 +1,107 @@
+"""
+Generates synthetic games in the chess_games.csv format, at any number of rows.
+
+Openings (ECO code, name and number of opening moves) and increment codes are resampled from the real games in
+data/chess_games.csv, so their distributions (and hence the ECO vocabulary and the distinct increment codes)
+look like the real thing. Ratings are drawn around the sample's mean, outcomes depend on the rating difference
+as the Elo model predicts, players come from a pool with a few very active players, and timestamps have the
+same 10**7 ms granularity as the real export. Rows are written in chunks, so memory use doesn't grow with the
+number of rows.
+
+    python -m benchmarks.synthetic_games --rows 1000000 --output /tmp/games_1m.csv
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.loading import RAW_GAMES_PATH, load_raw_games
+
+ID_ALPHABET = np.frombuffer(
+    b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", dtype=np.uint8
+)
+GENERATION_CHUNK_SIZE = 1_000_000
+TIMESTAMP_GRANULARITY_MS = 10**7
+FIRST_GAME_MS = 1.37e12
+LAST_GAME_MS = 1.505e12
+DRAW_RATE = 0.05
+
+
+def _random_ids(rng, n, length=8):
+    letters = ID_ALPHABET[rng.integers(0, len(ID_ALPHABET), size=(n, length))]
+    return letters.view(f"S{length}").ravel().astype(str)
+
+
+def _random_chunk(rng, sample, n, players):
+    # Openings and time controls are resampled jointly from the real games
+    resampled = sample.iloc[rng.integers(0, len(sample), size=n)].reset_index(drop=True)
+
+    white_rating = rng.normal(1590, 290, size=n).clip(750, 2700).astype(int)
+    black_rating = rng.normal(1590, 290, size=n).clip(750, 2700).astype(int)
+
+    # Elo expected score for white, with a flat chance of a draw
+    white_expected = 1 / (1 + 10 ** ((black_rating - white_rating) / 400))
+    draws = rng.random(n) < DRAW_RATE
+    winner = np.where(rng.random(n) < white_expected, "white", "black")
+    winner[draws] = "draw"
+
+    # Timestamps are truncated to the same granularity as in the real export
+    created_at = rng.uniform(FIRST_GAME_MS, LAST_GAME_MS, size=n)
+    last_move_at = created_at + rng.exponential(1.5e6, size=n)
+    created_at -= created_at % TIMESTAMP_GRANULARITY_MS
+    last_move_at -= last_move_at % TIMESTAMP_GRANULARITY_MS
+
+    # A Zipf-like choice of players, so some play many games
+    white_id = players[rng.zipf(1.3, size=n) % len(players)]
+    black_id = players[rng.zipf(1.3, size=n) % len(players)]
+
+    return pd.DataFrame(
+        {
+            "id": _random_ids(rng, n),
+            "rated": np.where(rng.random(n) < 0.8, "TRUE", "FALSE"),
+            "created_at": created_at,
+            "last_move_at": last_move_at,
+            "winner": winner,
+            "increment_code": resampled["increment_code"],
+            "white_id": white_id,
+            "white_rating": white_rating,
+            "black_id": black_id,
+            "black_rating": black_rating,
+            "opening_eco": resampled["opening_eco"],
+            "opening_name": resampled["opening_name"],
+            "opening_ply": resampled["opening_ply"],
+        }
+    )
+
+
+def generate_games(path, rows, seed=0, sample_path=RAW_GAMES_PATH):
+    rng = np.random.default_rng(seed)
+    sample = load_raw_games(
+        sample_path,
+        columns=["increment_code", "opening_eco", "opening_name", "opening_ply"],
+    ).astype({"increment_code": str, "opening_eco": str, "opening_name": str})
+    players = _random_ids(rng, max(rows // 10, 1), length=10)
+
+    written = 0
+    while written < rows:
+        n = min(GENERATION_CHUNK_SIZE, rows - written)
+        chunk = _random_chunk(rng, sample, n, players)
+        chunk.to_csv(
+            path,
+            mode="w" if written == 0 else "a",
+            header=written == 0,
+            index=False,
+            float_format="%.5E",
+        )
+        written += n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic chess games.")
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_games(args.output, args.rows, args.seed)
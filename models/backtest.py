@@ -0,0 +1,125 @@
+"""
+Walk-forward backtest of the random forest and logistic regression models, retrained window by window.
+
+Games are ordered by created_at, which the design matrix doesn't hold, so it is read back from the raw games the
+design matrix was built from (see src/backtest.py). Every combination of --models and --strategies is walked
+forward over the same windows:
+* refit fits the model from scratch on the training window before every window
+* warm updates the previous model instead: the random forest swaps its oldest trees for new ones fitted on the
+  games since the last update, and the logistic regression restarts its solver from the previous coefficients
+
+For each window we print the accuracy on its games and the cost of the update before it, followed by a summary
+comparing the strategies, e.g. for daily retraining on the last 90 days:
+
+    python -m models.backtest --window-days 1 --train-days 90 --report backtest.csv
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.backtest import (
+    UPDATERS,
+    design_matrix_created_at,
+    summarize_backtest,
+    walk_forward,
+)
+from src.design_matrix import load_features_and_target
+from src.loading import RAW_GAMES_PATH
+from src.schema import load_schema, schema_columns, schema_eco_vocabularies
+
+MODELS = sorted({model_name for model_name, _ in UPDATERS})
+STRATEGIES = ["refit", "warm"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Walk-forward backtest of retraining the outcome models."
+    )
+    parser.add_argument(
+        "design_matrix",
+        nargs="?",
+        default="./data/processed_chess_games.csv",
+        help="processed games as .csv, .parquet or .feather",
+    )
+    parser.add_argument(
+        "--raw",
+        default=RAW_GAMES_PATH,
+        help="the raw games the design matrix was built from, for their created_at",
+    )
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=MODELS)
+    parser.add_argument(
+        "--strategies", nargs="+", choices=STRATEGIES, default=STRATEGIES
+    )
+    parser.add_argument("--window-days", type=float, default=1)
+    parser.add_argument(
+        "--train-days",
+        type=float,
+        default=None,
+        help="train on the games of the last this many days, instead of all earlier games",
+    )
+    parser.add_argument(
+        "--min-train-rows",
+        type=int,
+        default=2000,
+        help="games played before the first window",
+    )
+    parser.add_argument("--report", help="save the results of every window as CSV")
+    args = parser.parse_args()
+
+    # The same features as the model scripts, by their groups in the schema of the design matrix
+    schema = load_schema(args.design_matrix)
+    features = schema_columns(
+        schema,
+        ["rated", "ratings", "time_limit", "eco", "time_of_play", "player_history"],
+    )
+    eco_vocabularies = (
+        schema_eco_vocabularies(schema) if schema["eco_encoding"] == "codes" else None
+    )
+    X, y, features = load_features_and_target(
+        args.design_matrix, features, "outcome", eco_vocabularies
+    )
+    if eco_vocabularies is None:
+        X = X.to_numpy(dtype=np.float32)
+
+    created_at = design_matrix_created_at(args.raw)
+    if len(created_at) != len(y):
+        raise ValueError(
+            f"{args.design_matrix} has {len(y)} games, "
+            f"but {args.raw} has {len(created_at)}"
+        )
+
+    pd.set_option("display.width", 200)
+    results = []
+    summaries = {}
+    for model_name in args.models:
+        for strategy in args.strategies:
+            windows = walk_forward(
+                UPDATERS[model_name, strategy](),
+                X,
+                y,
+                created_at,
+                args.window_days,
+                args.train_days,
+                args.min_train_rows,
+            )
+            print(f"\n{model_name} ({strategy}):")
+            print(windows.to_string(index=False, float_format="{:.3f}".format))
+
+            summaries[model_name, strategy] = summarize_backtest(windows)
+            results.append(windows.assign(model=model_name, strategy=strategy))
+
+    print(
+        f"\n{'model':22s}{'strategy':>9s}{'windows':>9s}{'accuracy':>10s}"
+        f"{'fit s':>10s}{'fit CPU s':>11s}{'CPU s/window':>14s}"
+    )
+    for (model_name, strategy), summary in summaries.items():
+        print(
+            f"{model_name:22s}{strategy:>9s}{summary['windows']:9d}"
+            f"{summary['accuracy']:10.4f}{summary['fit_seconds']:10.2f}"
+            f"{summary['fit_cpu_seconds']:11.2f}"
+            f"{summary['fit_cpu_seconds_per_window']:14.3f}"
+        )
+
+    if args.report:
+        pd.concat(results, ignore_index=True).to_csv(args.report, index=False)
@@ -0,0 +1,133 @@
+import argparse
+
+import numpy as np
+from scipy import sparse
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+
+from src.design_matrix import (
+    cap_eco_codes,
+    eco_codes_to_sparse,
+    load_eco_code_features_and_target,
+)
+from src.evaluation import fit_and_evaluate, print_timings
+from src.model_registry import (
+    load_cached_model,
+    model_fingerprint,
+    model_path,
+    save_cached_model,
+    save_model,
+)
+from src.schema import load_schema, schema_columns, schema_eco_vocabularies
+
+# HistGradientBoostingClassifier bins each categorical feature into at most max_bins (255 by default) categories
+MAX_ECO_CATEGORIES = 255
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "design_matrix",
+    nargs="?",
+    default="./data/processed_chess_games.csv",
+    help="processed games as .csv, .parquet or .feather, with ECO codes or one-hot columns",
+)
+parser.add_argument(
+    "--save",
+    default=model_path("gradient_boosting"),
+    help="where to save the fitted model",
+)
+parser.add_argument(
+    "--retrain",
+    action="store_true",
+    help="fit the model even if a cached one matches the data and parameters",
+)
+parser.add_argument(
+    "--compare",
+    action="store_true",
+    help="also fit the random forest and logistic regression on the same split, and compare",
+)
+args = parser.parse_args()
+
+# Define features and target variable, by their groups in the schema of the design matrix
+# Each ECO truncation is one categorical column of vocabulary codes, rather than a block of one-hot columns
+schema = load_schema(args.design_matrix)
+features = schema_columns(
+    schema, ["rated", "ratings", "time_limit", "time_of_play", "player_history"]
+)
+target = "outcome"
+
+# Load the preprocessed dataset, reading only the columns the model uses
+eco_vocabularies = schema_eco_vocabularies(schema)
+X, y, features = load_eco_code_features_and_target(
+    args.design_matrix, features, target, eco_vocabularies
+)
+# On large datasets the vocabularies can outgrow what the classifier takes, so the rarest codes become "other"
+X, eco_vocabularies = cap_eco_codes(X, eco_vocabularies, MAX_ECO_CATEGORIES)
+eco_features = [f"eco_{chars}" for chars in sorted(eco_vocabularies)]
+
+# Split the dataset into training and testing sets
+split = {"test_size": 0.2, "random_state": 13}
+X_train, X_test, y_train, y_test = train_test_split(X, y, **split)
+
+# Train a gradient boosting classifier on binned features, with the ECO codes as native categoricals
+# Boosting stops once the loss on a held-out tenth of the training set stops improving
+gb_classifier = HistGradientBoostingClassifier(
+    categorical_features=eco_features,
+    max_iter=500,
+    early_stopping=True,
+    validation_fraction=0.1,
+    n_iter_no_change=10,
+    random_state=42,
+)
+fingerprint = model_fingerprint(gb_classifier, X, y, features, **split)
+cached = None if args.retrain else load_cached_model(fingerprint)
+if cached is None:
+    # Fit, then evaluate the classifier on the testing set
+    metrics = fit_and_evaluate(gb_classifier, X_train, X_test, y_train, y_test)
+    save_cached_model(fingerprint, gb_classifier, features, metrics)
+else:
+    gb_classifier, _, metrics = cached
+    print(f"Using cached model {fingerprint[:12]}")
+save_model(gb_classifier, features, args.save, eco_vocabularies)
+
+print("Classification Report:")
+print(metrics["classification_report"])
+
+accuracy = metrics["accuracy"]
+print(f"Accuracy: {accuracy:.2f}")
+print_timings(metrics)
+print(f"Boosting iterations: {gb_classifier.n_iter_}")
+
+if args.compare:
+    # The other models need the ECO codes one-hot encoded, which they accept as a sparse matrix
+    def one_hot(X):
+        dense = sparse.csr_matrix(
+            X.drop(columns=eco_features).to_numpy(dtype=np.float32)
+        )
+        eco_matrix, _ = eco_codes_to_sparse(X, eco_vocabularies)
+        return sparse.hstack([dense, eco_matrix], format="csr")
+
+    X_train_one_hot, X_test_one_hot = one_hot(X_train), one_hot(X_test)
+
+    results = {"gradient_boosting": metrics}
+    baselines = {
+        "random_forest": RandomForestClassifier(n_estimators=100, random_state=42),
+        "logistic_regression": LogisticRegression(max_iter=1000),
+    }
+    for name, model in baselines.items():
+        results[name] = fit_and_evaluate(
+            model, X_train_one_hot, X_test_one_hot, y_train, y_test
+        )
+
+    print("\nComparison on the same split:")
+    print(
+        f"{'model':22s}{'accuracy':>10s}{'fit s':>10s}{'fit CPU s':>11s}{'predict rows/s':>16s}"
+    )
+    for name, result in results.items():
+        # Cached metrics may predate the timings
+        print(
+            f"{name:22s}{result['accuracy']:10.4f}"
+            f"{result.get('fit_seconds', np.nan):10.2f}"
+            f"{result.get('fit_cpu_seconds', np.nan):11.2f}"
+            f"{result.get('predict_rows_per_second', np.nan):16,.0f}"
+        )
@@ -0,0 +1,204 @@
+"""
+Cross-validated hyperparameter search over the random forest and logistic regression models.
+
+Every candidate parameter setting (all of a grid, or --n-iter random draws from it) is scored with stratified
+k-fold cross-validation. Each (model, parameters, fold) fit is an independent task, and the tasks run in parallel
+over --jobs worker processes through joblib, which memory-maps the design matrix into the workers rather than
+copying it into each.
+
+The result of every fold is cached (see src/model_registry.py) as soon as it finishes, keyed by the data, the
+features, the estimator and its parameters, and the folds. Rerunning an interrupted search therefore only fits
+the folds that hadn't finished, and widening a grid only fits the new candidates.
+
+    python -m models.hyperparameter_search --models random_forest --search random --n-iter 20 --jobs 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import ParameterGrid, ParameterSampler, StratifiedKFold
+
+from src.design_matrix import load_features_and_target
+from src.model_registry import (
+    data_fingerprint,
+    load_cached_result,
+    model_fingerprint,
+    save_cached_result,
+)
+from src.schema import load_schema, schema_columns, schema_eco_vocabularies
+
+# The estimators, with the fixed parameters of the model scripts, and the grids searched over
+ESTIMATORS = {
+    "random_forest": RandomForestClassifier(n_estimators=100, random_state=42),
+    "logistic_regression": LogisticRegression(max_iter=1000),
+}
+PARAMETER_GRIDS = {
+    "random_forest": {
+        "n_estimators": [50, 100, 200],
+        "max_depth": [None, 10, 20],
+        "min_samples_leaf": [1, 5, 20],
+        "max_features": ["sqrt", 0.3],
+    },
+    "logistic_regression": {
+        "C": [0.01, 0.1, 1.0, 10.0],
+        "class_weight": [None, "balanced"],
+    },
+}
+
+
+def _fit_fold(task, X, y):
+    # Runs in a worker process, returning the task's key along with its result
+    key, estimator, train, test = task
+    start, start_cpu = time.perf_counter(), time.process_time()
+    estimator.fit(X[train], y[train])
+    fit_seconds = time.perf_counter() - start
+    fit_cpu_seconds = time.process_time() - start_cpu
+
+    return key, {
+        "accuracy": accuracy_score(y[test], estimator.predict(X[test])),
+        "fit_seconds": fit_seconds,
+        "fit_cpu_seconds": fit_cpu_seconds,
+    }
+
+
+def candidates(model_name, search, n_iter, seed):
+    grid = PARAMETER_GRIDS[model_name]
+    if search == "grid":
+        return list(ParameterGrid(grid))
+    return list(ParameterSampler(grid, n_iter=n_iter, random_state=seed))
+
+
+def run_search(X, y, features, model_names, search, n_iter, folds, seed, jobs):
+    """
+    Cross-validates every candidate of every model, returning {(model name, params): [fold results]}.
+    """
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    splits = list(cv.split(np.zeros(len(y)), y))
+    data_digest = data_fingerprint(X, y)
+
+    # One task per fold of every candidate, skipping the folds already in the cache
+    results = {}
+    tasks = []
+    for model_name in model_names:
+        for params in candidates(model_name, search, n_iter, seed):
+            # Parallelism comes from running folds side by side, so each fit uses one core
+            estimator = clone(ESTIMATORS[model_name]).set_params(**params)
+            if "n_jobs" in estimator.get_params():
+                estimator.set_params(n_jobs=1)
+
+            candidate = (model_name, repr(params))
+            results[candidate] = [None] * folds
+            for fold, (train, test) in enumerate(splits):
+                fingerprint = model_fingerprint(
+                    estimator,
+                    None,
+                    None,
+                    features,
+                    data_digest=data_digest,
+                    folds=folds,
+                    fold=fold,
+                    random_state=seed,
+                )
+                cached = load_cached_result(fingerprint)
+                if cached is None:
+                    key = (candidate, fold, fingerprint)
+                    tasks.append((key, estimator, train, test))
+                else:
+                    results[candidate][fold] = cached
+
+    n_folds = len(results) * folds
+    print(f"{len(tasks)} of {n_folds} folds to fit, the others are cached")
+
+    # Results are cached in the order they finish, so an interruption only loses the folds still running
+    outputs = Parallel(n_jobs=jobs, return_as="generator_unordered")(
+        delayed(_fit_fold)(task, X, y) for task in tasks
+    )
+    for (candidate, fold, fingerprint), result in outputs:
+        save_cached_result(fingerprint, result)
+        results[candidate][fold] = result
+        print(f"{' '.join(candidate)} fold {fold}: {result['accuracy']:.4f}")
+
+    return results
+
+
+def print_summary(results):
+    rows = []
+    for (model_name, params), fold_results in results.items():
+        accuracies = [r["accuracy"] for r in fold_results]
+        fit_cpu_seconds = sum(r["fit_cpu_seconds"] for r in fold_results)
+        rows.append(
+            (
+                np.mean(accuracies),
+                np.std(accuracies),
+                fit_cpu_seconds,
+                model_name,
+                params,
+            )
+        )
+
+    print(f"\n{'accuracy':>9s} {'std':>7s} {'fit CPU s':>10s}  model / parameters")
+    for mean, std, fit_cpu_seconds, model_name, params in sorted(rows, reverse=True):
+        print(f"{mean:9.4f} {std:7.4f} {fit_cpu_seconds:10.1f}  {model_name} {params}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Cross-validated hyperparameter search for the outcome models."
+    )
+    parser.add_argument(
+        "design_matrix",
+        nargs="?",
+        default="./data/processed_chess_games.csv",
+        help="processed games as .csv, .parquet or .feather",
+    )
+    parser.add_argument(
+        "--models", nargs="+", choices=sorted(ESTIMATORS), default=sorted(ESTIMATORS)
+    )
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument(
+        "--n-iter",
+        type=int,
+        default=10,
+        help="number of candidates per model for --search random",
+    )
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument(
+        "--jobs", type=int, default=-1, help="worker processes, -1 for one per core"
+    )
+    args = parser.parse_args()
+
+    # Every column of the design matrix but the targets is a feature
+    schema = load_schema(args.design_matrix)
+    features = schema_columns(
+        schema,
+        ["rated", "ratings", "time_limit", "eco", "time_of_play", "player_history"],
+    )
+    # ECO code columns are expanded into sparse one-hot blocks of the schema's vocabulary
+    eco_vocabularies = (
+        schema_eco_vocabularies(schema) if schema["eco_encoding"] == "codes" else None
+    )
+    X, y, features = load_features_and_target(
+        args.design_matrix, features, "outcome", eco_vocabularies
+    )
+    if eco_vocabularies is None:
+        X = X.to_numpy(dtype=np.float32)
+
+    results = run_search(
+        X,
+        y.to_numpy(),
+        features,
+        args.models,
+        args.search,
+        args.n_iter,
+        args.folds,
+        args.seed,
+        args.jobs,
+    )
+    print_summary(results)
@@ -1,127 +1,116 @@
+import argparse
+
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import classification_report, accuracy_score
 
-# Load the preprocessed dataset
-df = pd.read_csv("./data/processed_chess_games.csv")
+from src.design_matrix import load_features_and_target
+from src.evaluation import fit_and_evaluate, print_timings
+from src.model_registry import (
+    load_cached_model,
+    model_fingerprint,
+    model_path,
+    save_cached_model,
+    save_model,
+)
+from src.schema import load_schema, schema_columns, schema_eco_vocabularies
+from src.online_learning import fit_online_logistic_regression
 
-# Define features and target variable
-features = [
-    "rated",
-    "white_rating",
-    "black_rating",
-    "approx_time_limit_hours",
-    "white_rating_advantage",
-    "eco_1_A",
-    "eco_1_B",
-    "eco_1_C",
-    "eco_1_D",
-    "eco_1_E",
-    "eco_2_A0",
-    "eco_2_A1",
-    "eco_2_A2",
-    "eco_2_A4",
-    "eco_2_A5",
-    "eco_2_A8",
-    "eco_2_B0",
-    "eco_2_B1",
-    "eco_2_B2",
-    "eco_2_B3",
-    "eco_2_B4",
-    "eco_2_B5",
-    "eco_2_B9",
-    "eco_2_C0",
-    "eco_2_C1",
-    "eco_2_C2",
-    "eco_2_C3",
-    "eco_2_C4",
-    "eco_2_C5",
-    "eco_2_C6",
-    "eco_2_C7",
-    "eco_2_D0",
-    "eco_2_D1",
-    "eco_2_D2",
-    "eco_2_D3",
-    "eco_2_other",
-    "eco_3_A00",
-    "eco_3_A01",
-    "eco_3_A04",
-    "eco_3_A06",
-    "eco_3_A10",
-    "eco_3_A40",
-    "eco_3_A45",
-    "eco_3_B00",
-    "eco_3_B01",
-    "eco_3_B02",
-    "eco_3_B06",
-    "eco_3_B07",
-    "eco_3_B10",
-    "eco_3_B12",
-    "eco_3_B20",
-    "eco_3_B21",
-    "eco_3_B23",
-    "eco_3_B30",
-    "eco_3_B32",
-    "eco_3_B40",
-    "eco_3_B50",
-    "eco_3_B90",
-    "eco_3_C00",
-    "eco_3_C01",
-    "eco_3_C02",
-    "eco_3_C20",
-    "eco_3_C21",
-    "eco_3_C23",
-    "eco_3_C24",
-    "eco_3_C40",
-    "eco_3_C41",
-    "eco_3_C42",
-    "eco_3_C44",
-    "eco_3_C45",
-    "eco_3_C46",
-    "eco_3_C50",
-    "eco_3_C55",
-    "eco_3_C57",
-    "eco_3_C60",
-    "eco_3_C62",
-    "eco_3_C65",
-    "eco_3_D00",
-    "eco_3_D02",
-    "eco_3_D06",
-    "eco_3_D10",
-    "eco_3_D20",
-    "eco_3_D30",
-    "eco_3_other",
-    "month_of_year",
-    "day_of_week",
-    "hour_of_day",
-]
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "design_matrix",
+    nargs="?",
+    default="./data/processed_chess_games.csv",
+    help="processed games as .csv, .parquet or .feather",
+)
+parser.add_argument(
+    "--save",
+    default=model_path("logistic_regression"),
+    help="where to save the fitted model, for use by models/prediction_server.py",
+)
+parser.add_argument(
+    "--retrain",
+    action="store_true",
+    help="fit the model even if a cached one matches the data and parameters",
+)
+parser.add_argument(
+    "--online",
+    action="store_true",
+    help="stream the design matrix in chunks and fit by SGD, for data too large to load",
+)
+parser.add_argument("--chunk-size", type=int, default=100_000)
+parser.add_argument(
+    "--batch-size", type=int, default=5_000, help="rows per SGD update with --online"
+)
+parser.add_argument(
+    "--epochs", type=int, default=10, help="passes over the data with --online"
+)
+args = parser.parse_args()
+
+# Define features and target variable, by their groups in the schema of the design matrix
+schema = load_schema(args.design_matrix)
+features = schema_columns(
+    schema,
+    ["rated", "ratings", "time_limit", "eco", "time_of_play", "player_history"],
+)
 target = "outcome"
 
-# Split the dataset into training and testing sets
-X_train, X_test, y_train, y_test = train_test_split(
-    df[features], df[target], test_size=0.2, random_state=13
+# ECO code columns (--eco-encoding codes) are expanded into sparse one-hot blocks of the schema's vocabulary
+eco_vocabularies = (
+    schema_eco_vocabularies(schema) if schema["eco_encoding"] == "codes" else None
 )
 
-# Train a logistic regression model
-logistic_regression = LogisticRegression(max_iter=1000)
-logistic_regression.fit(X_train, y_train)
+if args.online:
+    # Fit on one chunk of the design matrix at a time, so it is never all in memory (nor hashed for the cache)
+    logistic_regression, features, metrics = fit_online_logistic_regression(
+        args.design_matrix,
+        features,
+        target,
+        eco_vocabularies,
+        args.chunk_size,
+        args.batch_size,
+        args.epochs,
+    )
 
-# Make predictions on the testing set
-y_pred = logistic_regression.predict(X_test)
+    # Map the coefficients back from the scaled features, to be comparable with the batch model's
+    scaler, classifier = logistic_regression
+    coefficients = classifier.coef_[0] / scaler.scale_
+else:
+    # Load the preprocessed dataset, reading only the columns the model uses
+    X, y, features = load_features_and_target(
+        args.design_matrix, features, target, eco_vocabularies
+    )
+
+    # Split the dataset into training and testing sets
+    split = {"test_size": 0.2, "random_state": 13}
+    X_train, X_test, y_train, y_test = train_test_split(X, y, **split)
+
+    # Train a logistic regression model, unless one was already fitted on the same data and parameters
+    logistic_regression = LogisticRegression(max_iter=1000)
+    fingerprint = model_fingerprint(logistic_regression, X, y, features, **split)
+    cached = None if args.retrain else load_cached_model(fingerprint)
+    if cached is None:
+        # Fit, then evaluate the model on the testing set
+        metrics = fit_and_evaluate(
+            logistic_regression, X_train, X_test, y_train, y_test
+        )
+        save_cached_model(fingerprint, logistic_regression, features, metrics)
+    else:
+        logistic_regression, _, metrics = cached
+        print(f"Using cached model {fingerprint[:12]}")
+    coefficients = logistic_regression.coef_[0]
+save_model(logistic_regression, features, args.save, schema_eco_vocabularies(schema))
 
-# Evaluate the model
 print("Classification Report:")
-print(classification_report(y_test, y_pred))
+print(metrics["classification_report"])
 
-accuracy = accuracy_score(y_test, y_pred)
+accuracy = metrics["accuracy"]
 print(f"Accuracy: {accuracy:.2f}")
+print_timings(metrics)
 
 # Interpretation: Coefficients of logistic regression
 pd.set_option("display.max_rows", None)
-coefficients = pd.DataFrame(
-    {"Feature": features, "Coefficient": logistic_regression.coef_[0]}
-)
+coefficients = pd.DataFrame({"Feature": features, "Coefficient": coefficients})
 
 # Sort the coefficients by absolute value
 coefficients["Absolute_Coefficient"] = coefficients["Coefficient"].abs()
@@ -0,0 +1,239 @@
+"""
+Local HTTP server for pre-game outcome probabilities.
+
+Loads a model saved by models/random_forest.py or models/logistic_regression.py, and serves:
+* POST /predict, with a raw game (or a list of raw games) as JSON using the chess_games.csv schema,
+  returning the probability of each outcome
+* GET /stats, returning p50/p99 request latency and throughput since startup
+
+Requests are featurized with FeaturePipeline, using the ECO vocabularies saved with the model, and queued.
+Games that can't be featurized are rejected with a 400 right away, before they are batched with anyone else's. A
+single batcher task takes whatever is queued, up to --max-batch-size games, waiting at most --max-batch-delay-ms
+for more to arrive, and makes one predict_proba call for the whole batch. Under concurrent load this amortizes
+the per-call overhead of the model across requests. Should a batch still fail, its requests are retried one by
+one, so that only the offending request gets the error.
+
+Only the standard library is used for the server itself, so it speaks just enough HTTP/1.1 for local use.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+import warnings
+
+import numpy as np
+
+from scripts.duration_analysis import MAX_GAME_TIME_LIMIT_MINUTES
+from scripts.extract_features import ECO_VOCABULARY_PATH
+from src.features import load_eco_vocabulary
+from src.model_registry import load_model, model_path
+from src.pipeline import FeaturePipeline
+
+OUTCOME_NAMES = {1: "white", 0: "draw", -1: "black"}
+LATENCY_WINDOW = 10_000
+
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found"}
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predictions into batched predict_proba calls.
+    """
+
+    def __init__(self, model, max_batch_size, max_batch_delay):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue = asyncio.Queue()
+
+    async def predict(self, rows):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a first request, then gather more until the batch is full or the delay runs out
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_batch_delay
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            # Predict off the event loop, so that requests keep being accepted meanwhile
+            rows = np.vstack([rows for rows, _ in batch])
+            try:
+                probabilities = await loop.run_in_executor(
+                    None, self.model.predict_proba, rows
+                )
+            except Exception:
+                # Don't fail every request for one bad one: predict them one by one instead
+                for item_rows, future in batch:
+                    try:
+                        probabilities = await loop.run_in_executor(
+                            None, self.model.predict_proba, item_rows
+                        )
+                    except Exception as error:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(probabilities)
+                continue
+
+            start = 0
+            for item_rows, future in batch:
+                future.set_result(probabilities[start : start + len(item_rows)])
+                start += len(item_rows)
+
+
+class PredictionServer:
+    def __init__(self, model, features, pipeline, max_batch_size, max_batch_delay):
+        self.pipeline = pipeline
+        self.classes = [OUTCOME_NAMES[c] for c in model.classes_]
+        self.batcher = MicroBatcher(model, max_batch_size, max_batch_delay)
+
+        # Features over whole histories of games (e.g. player history) can't be computed for a single game
+        missing = [f for f in features if f not in pipeline.feature_names]
+        if missing:
+            raise ValueError(
+                f"the model uses features the server can't compute: {missing}"
+            )
+
+        # One-hot ECO columns of another vocabulary would silently change which column a game's code lands in
+        model_eco = [f for f in features if f.startswith("eco_")]
+        pipeline_eco = [f for f in pipeline.feature_names if f.startswith("eco_")]
+        if model_eco and set(model_eco) != set(pipeline_eco):
+            raise ValueError(
+                "the model was trained on other ECO vocabularies than the server's"
+            )
+
+        # The model may have been trained on the features in another order than the pipeline produces them
+        self._column_order = [pipeline.feature_names.index(f) for f in features]
+
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._requests = 0
+        self._started = time.perf_counter()
+
+    async def predict(self, games):
+        rows = self.pipeline.transform_records(games)[:, self._column_order]
+        if not np.isfinite(rows).all():
+            raise ValueError("games have missing or non-numeric features")
+        probabilities = await self.batcher.predict(rows)
+        return [dict(zip(self.classes, p.tolist())) for p in probabilities]
+
+    def stats(self):
+        # Latency percentiles are over the last LATENCY_WINDOW requests
+        stats = {
+            "requests": self._requests,
+            "throughput_per_second": self._requests
+            / (time.perf_counter() - self._started),
+        }
+        if self._latencies:
+            latencies_ms = np.array(self._latencies) * 1000
+            stats["latency_p50_ms"] = float(np.percentile(latencies_ms, 50))
+            stats["latency_p99_ms"] = float(np.percentile(latencies_ms, 99))
+        return stats
+
+    async def _respond(self, method, path, body):
+        if method == "GET" and path == "/stats":
+            return 200, self.stats()
+        if method != "POST" or path != "/predict":
+            return 404, {"error": f"no route for {method} {path}"}
+
+        start = time.perf_counter()
+        try:
+            payload = json.loads(body)
+            games = payload if isinstance(payload, list) else [payload]
+            if not games:
+                raise ValueError("no games to predict")
+            predictions = await self.predict(games)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return 400, {"error": repr(error)}
+        self._latencies.append(time.perf_counter() - start)
+        self._requests += 1
+
+        return 200, predictions if isinstance(payload, list) else predictions[0]
+
+    async def handle_connection(self, reader, writer):
+        # Serve requests on the connection until the client closes it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, response = await self._respond(method, path, body)
+                content = json.dumps(response).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n\r\n".encode() + content
+                )
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        batcher_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving predictions on http://{host}:{port}/predict")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve pre-game outcome probabilities."
+    )
+    parser.add_argument("--model", default=model_path("random_forest"))
+    parser.add_argument(
+        "--vocabulary",
+        default=ECO_VOCABULARY_PATH,
+        help="ECO vocabularies, only for models saved without their own",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-batch-delay-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    # The models were fitted on DataFrames, but are served plain NumPy rows in the same column order
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+    model, features, eco_vocabularies = load_model(args.model)
+    if eco_vocabularies is None:
+        eco_vocabularies = load_eco_vocabulary(args.vocabulary)
+    pipeline = FeaturePipeline(eco_vocabularies, MAX_GAME_TIME_LIMIT_MINUTES)
+    server = PredictionServer(
+        model,
+        features,
+        pipeline,
+        args.max_batch_size,
+        args.max_batch_delay_ms / 1000,
+    )
+    asyncio.run(server.serve(args.host, args.port))
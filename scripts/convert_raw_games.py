@@ -0,0 +1,26 @@
+"""
+This is a script to convert the raw chess games csv into a memory-mapped columnar store (see src/game_store.py).
+
+The store is written next to the csv (e.g. data/chess_games.store), where the loaders look for it. Once
+converted, every script that loads the raw games (through src/loading.py) memory-maps the store instead of
+parsing the csv. The store has to be converted again whenever the csv changes, until then it is ignored.
+"""
+
+import argparse
+import time
+
+from src.game_store import convert_raw_games
+from src.loading import RAW_GAMES_PATH
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the raw chess games into a columnar store."
+    )
+    parser.add_argument("--input", default=RAW_GAMES_PATH)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = convert_raw_games(args.input, args.chunk_size)
+    seconds = time.perf_counter() - start
+    print(f"Converted {len(store)} games into {store.path} in {seconds:.2f}s")
@@ -3,27 +3,44 @@ This script gives a summary of the "created_at" and "last_move_at" fields, as we
 It shows that something is wrong with these fields in the chess_games.csv dataset.
 
 First off, it is noteworthy that all timestamps seem to be in the format "{1.5f}E+12" (e.g. "1.50421E+12"),
-which means they have a granularity of 10**7 ms, or about 3 hours.
+which means they have a granularity of 10**7 ms, or about 3 hours. The script detects this granularity, and the
+share of games whose duration is computed from such rounded timestamps (see src/timestamps.py).
 
 The effect of this 3 hour granularity is that in 91.64% (all but 8.36%) of games the values of created_at
 and last_move_at coincide, preventing us from extracting useful duration information from these columns.
 Instead, we will approximate game duration by using the increment code and assuming a 40 move game.
 """
 
-import pandas as pd
 import matplotlib.pyplot as plt
+import pandas as pd
 
 from src.features import add_approx_time_limit_column, add_game_duration_column
+from src.query import GameQuery
+from src.timestamps import MS_PER_HOUR, decode_timestamps, timestamp_granularity
 
 MAX_GAME_TIME_LIMIT_MINUTES = 60
 
 
-def start_and_end_time_analysis(df):
+def start_and_end_time_analysis(games):
+    df = games.select("created_at", "last_move_at").collect()
     df = add_game_duration_column(df)
 
+    # Print out the time span and precision of the timestamps
+    created_at = decode_timestamps(df["created_at"])
+    first, last = pd.to_datetime([created_at.min(), created_at.max()], unit="ms")
+    print(f"Games created from {first} to {last}")
+    for column in ["created_at", "last_move_at"]:
+        granularity = timestamp_granularity(df[column])
+        hours = granularity / MS_PER_HOUR
+        print(f"Granularity of {column}: {granularity} ms ({hours:.2f} hours)")
+    low_precision_percentage = df["low_precision_duration"].mean() * 100
+    print(
+        f"Percentage of games with low precision durations: {low_precision_percentage:.2f}%"
+    )
+
     # Print out summary statistics of game durations
     print("Summary statistics of game durations:")
-    print(df[["created_at", "last_move_at", "game_duration"]].describe())
+    print(df[["game_duration"]].describe())
 
     # Calculate the percentage of games with nonzero duration
     nonzero_duration_percentage = (df["game_duration"] > 0).mean() * 100
@@ -45,8 +62,9 @@ def start_and_end_time_analysis(df):
     plt.show()
 
 
-def plot_games_by_approx_time_limit(df):
+def plot_games_by_approx_time_limit(games):
     # compute the data to show
+    df = games.select("increment_code", "opening_ply").collect()
     df = add_approx_time_limit_column(df, MAX_GAME_TIME_LIMIT_MINUTES)
 
     # Print out summary statistics of game time limits
@@ -72,12 +90,11 @@ def plot_games_by_approx_time_limit(df):
 
 
 if __name__ == "__main__":
-    # Load the dataset
-    df = pd.read_csv("./data/chess_games.csv")
-    df.drop_duplicates(subset="id", keep="first", inplace=True)
+    # Each analysis only reads the columns it needs, of the deduplicated games
+    games = GameQuery()
 
     # Show that start and end times mostly coincide
-    start_and_end_time_analysis(df)
+    start_and_end_time_analysis(games)
 
     # Show the approx time we'll use
-    plot_games_by_approx_time_limit(df)
+    plot_games_by_approx_time_limit(games)
@@ -19,76 +19,673 @@ Related to position:
 * First 1, 2, and 3 character of ECO codes for which there are more than 100 games available
 *   (each of the above is one-hot encoded)
 
+Related to player history (with --player-history, see src/player_history.py), for both players:
+* number of games played before
+* average score over their recent games
+* rating trend over their recent games
+
 Target variable:
 * Game outcome (white, black, and draw, encoded as +1, -1, and 0)
 * Whether game ended in a draw
 
 All bools are being stored as ints, because it reduces the resulting file to 37% of the size it would have otherwise.
+
+The raw games are streamed in chunks of CHUNK_SIZE rows, so peak memory is bounded by the chunk size rather
+than by the size of the dataset. Since the ECO cutoff depends on counts over the whole dataset, the ECO
+vocabulary is fitted in a cheap first pass that reads only the "id" and "opening_eco" columns, and is saved to
+ECO_VOCABULARY_PATH. The second pass encodes every chunk against that frozen vocabulary, so the columns of the
+design matrix don't depend on how the games are chunked. Pass --frozen-vocabulary to reuse a saved vocabulary.
+
+The output format follows the extension of --output: ".parquet" and ".feather" write a typed, compressed
+columnar file (see src/design_matrix.py), anything else writes CSV. With --eco-encoding codes, each ECO
+truncation is stored as a single column of integer codes into the vocabulary instead of one-hot columns.
+Next to the output, "{output}.schema.json" records its columns, their dtypes and feature groups, the ECO
+vocabulary and the normalization constants (see src/schema.py), from which the models pick their features.
+
+With --workers above 1, the raw csv is split into byte ranges of about --partition-mb each (cut at line breaks),
+and both passes run over the partitions in a process pool. The first pass also works out which rows repeat an
+earlier game id, so that workers can drop them, featurize and encode their partition independently. The main
+process then only appends the encoded partitions to the output, in file order.
+
+With --incremental, new games appended to the raw csv since the last run are featurized and appended to the
+existing (CSV) design matrix. "{output}.state.json" keeps the ECO vocabulary the design matrix was encoded with
+(rather than rereading the shared one, which later builds may refit), the byte offset up to which the raw csv
+has been processed, the size of the output up to there, and the GameIdIndex files holding the ids of the
+processed games, so games already in the design matrix are skipped. The state is checkpointed after every
+partition is written, with the partition's new ids in a run file of their own (merged into the main ids file
+once MAX_ID_RUN_FILES of them pile up), and a run after a crash first truncates the output back to the last checkpoint, so no
+rows are ever appended twice. The first incremental run, with no state yet, does a full build and records the
+state. The raw csv must only ever be appended to, and not while a run is in progress.
+
+The player history features depend on every earlier game of both players, so they are computed up front over
+all the deduplicated games, in one more pass over the raw csv, and then handed out to the chunks (or partitions)
+in file order. They can't be updated with --incremental.
+
+--profile prints the wall time, rows in and out, and memory delta of every stage (see src/profiling.py), summed
+over chunks; --profile-report saves the same as JSON, and --cprofile/--tracemalloc dump cProfile stats and a
+tracemalloc snapshot of the whole run.
 """
 
+import argparse
+import collections
+import io
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
 from scripts.duration_analysis import MAX_GAME_TIME_LIMIT_MINUTES
 from scripts.position_analysis import CUTOFF
+from src.dedup import (
+    ID_KEY_VERSION,
+    GameIdIndex,
+    drop_duplicate_games,
+    game_id_keys,
+)
+from src.design_matrix import (
+    DesignMatrixBuilder,
+    DesignMatrixWriter,
+    cast_design_matrix_dtypes,
+    design_matrix_columns,
+    design_matrix_format,
+    encode_design_matrix_chunk,
+    read_design_matrix_header,
+)
 from src.features import (
-    add_approx_time_limit_column,
-    add_game_outcome_column,
-    add_one_hot_encoding_for_truncated_eco_code,
-    add_time_component_columns,
+    RATING_OFFSET,
+    RATING_SCALE,
+    approx_time_limit_minutes,
+    fit_eco_vocabulary,
+    game_outcome_columns,
+    load_eco_vocabulary,
+    save_eco_vocabulary,
+    time_component_columns,
+    truncated_eco_codes,
+)
+from src.loading import RAW_GAMES_PATH, load_raw_games
+from src.player_history import (
+    PLAYER_HISTORY_COLUMNS,
+    PLAYER_HISTORY_SOURCE_COLUMNS,
+    PLAYER_WINDOW,
+    player_history_features,
+)
+from src.profiling import NULL_PROFILER, StageProfiler
+from src.schema import (
+    design_matrix_schema,
+    load_schema,
+    save_schema,
+    schema_eco_vocabularies,
 )
 
+PROCESSED_GAMES_PATH = "./data/processed_chess_games.csv"
+ECO_VOCABULARY_PATH = "./data/eco_vocabulary.json"
+CHUNK_SIZE = 100_000
+PARTITION_MB = 64
+# Partitions submitted to the pool per worker, ahead of the one being written
+TASKS_IN_FLIGHT_PER_WORKER = 2
+# Run files of game ids an incremental output can pile up before they are merged into its ids file
+MAX_ID_RUN_FILES = 16
+ECO_CHARS = [1, 2, 3]
 
-# Load the dataset
-df = pd.read_csv("./data/chess_games.csv")
-df.drop_duplicates(subset="id", keep="first", inplace=True)
 
+def _iter_unique_game_chunks(
+    path, chunk_size, seen_ids, profiler=NULL_PROFILER, **read_csv_kwargs
+):
+    # Stream the raw csv, dropping any game whose id has already been seen in this or an earlier chunk
+    chunks = load_raw_games(path, chunksize=chunk_size, **read_csv_kwargs)
+    for chunk in profiler.iterate("load", chunks):
+        with profiler.stage("dedup", chunk) as stage:
+            chunk = drop_duplicate_games(chunk, seen_ids)
+            stage.rows_out = len(chunk)
+        yield chunk
 
-# Drop irrelevant columns
-df.drop(
-    [
-        "id",
-        "white_id",
-        "black_id",
-        "opening_name",
-        "last_move_at",
-    ],
-    axis=1,
-    inplace=True,
-)
 
-# normalize ratings around 1500, with 1000 mapped to -1 and 2000 mapped to +1
-df["white_rating"] = (df["white_rating"] / 500) - 3
-df["black_rating"] = (df["black_rating"] / 500) - 3
-df["white_rating_advantage"] = df["white_rating"] - df["black_rating"]
-df["rated"] = df["rated"].astype(int)
+def _fit_eco_vocabularies(eco_counts):
+    return {chars: fit_eco_vocabulary(eco_counts, chars, CUTOFF) for chars in ECO_CHARS}
 
 
-# Compute approx time limit, after which increment code and number of opening moves are no longer needed
-df = add_approx_time_limit_column(df, MAX_GAME_TIME_LIMIT_MINUTES)
-df["approx_time_limit_hours"] = df["approx_time_limit_minutes"] / 60
-df.drop(
-    ["increment_code", "opening_ply", "approx_time_limit_minutes"], axis=1, inplace=True
-)
+def fit_eco_vocabularies(path, chunk_size):
+    # Count full ECO codes over the deduplicated games, reading only the columns needed to do so
+    eco_counts = pd.Series(dtype="int64")
+    for chunk in _iter_unique_game_chunks(
+        path, chunk_size, GameIdIndex(), columns=["id", "opening_eco"]
+    ):
+        eco_counts = eco_counts.add(chunk["opening_eco"].value_counts(), fill_value=0)
+
+    return _fit_eco_vocabularies(eco_counts)
+
+
+def _csv_byte_ranges(path, partition_bytes, min_partitions, start=None):
+    # Split the rows of the csv (from the byte offset start, if given) into byte ranges that each end on a line break
+    # This assumes no quoted field contains a line break, which holds for the lichess exports
+    with open(path, "rb") as f:
+        columns = f.readline().decode().rstrip("\r\n").split(",")
+        start = f.tell() if start is None else start
+        size = os.fstat(f.fileno()).st_size
+
+        # Make sure there are enough partitions to keep every worker busy
+        step = max(1, min(partition_bytes, -(-(size - start) // min_partitions)))
+
+        byte_ranges = []
+        while start < size:
+            f.seek(min(start + step, size))
+            f.readline()
+            byte_ranges.append((start, f.tell()))
+            start = f.tell()
+
+    return columns, byte_ranges
+
+
+def _read_byte_range(path, names, byte_range, columns=None):
+    start, end = byte_range
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return load_raw_games(io.BytesIO(data), columns, names=names, header=None)
+
+
+def fit_player_history(path, chunk_size):
+    # Histories span the whole file, so are computed over all deduplicated games, in the order they are featurized
+    chunks = _iter_unique_game_chunks(
+        path,
+        chunk_size,
+        GameIdIndex(),
+        columns=["id"] + PLAYER_HISTORY_SOURCE_COLUMNS,
+    )
+    games = pd.concat(list(chunks), ignore_index=True)
+    return player_history_features(games)
+
+
+def _imap_in_order(pool, function, tasks, max_in_flight):
+    # Like pool.map, but submits at most max_in_flight tasks ahead of the result being consumed, so finished
+    # partitions waiting for an earlier one never pile up in the main process
+    tasks = iter(tasks)
+    in_flight = collections.deque(
+        pool.submit(function, task) for task in itertools.islice(tasks, max_in_flight)
+    )
+    while in_flight:
+        result = in_flight.popleft().result()
+        for task in itertools.islice(tasks, 1):
+            in_flight.append(pool.submit(function, task))
+        yield result
+
+
+def _read_partition_ids(task):
+    path, columns, byte_range, read_columns = task
+    return _read_byte_range(path, columns, byte_range, read_columns)
+
+
+def _featurize_partition(task):
+    (
+        path,
+        columns,
+        byte_range,
+        duplicate_rows,
+        eco_vocabularies,
+        eco_encoding,
+        fmt,
+        player_history,
+        profile,
+    ) = task
+    # Workers profile their own stages, and send the totals back along with the partition
+    profiler = StageProfiler(enabled=profile)
+
+    with profiler.stage("load") as stage:
+        df = _read_byte_range(path, columns, byte_range)
+        stage.rows_out = len(df)
+    with profiler.stage("dedup", df) as stage:
+        df = df.drop(index=duplicate_rows)
+        stage.rows_out = len(df)
+    design_matrix = extract_features(
+        df, eco_vocabularies, eco_encoding, profiler, player_history
+    )
+    with profiler.stage("encode", design_matrix):
+        encoded = encode_design_matrix_chunk(design_matrix, fmt)
+    return encoded, profiler.stages
+
+
+def save_design_matrix_schema(
+    output_path, eco_vocabularies, eco_encoding, player_history=False
+):
+    # The sidecar records the dtypes as stored, which are narrower in the columnar formats
+    columns = design_matrix_columns(eco_vocabularies, eco_encoding, player_history)
+    if design_matrix_format(output_path) != "csv":
+        empty = pd.DataFrame({name: np.empty(0, dtype) for name, dtype in columns})
+        columns = list(cast_design_matrix_dtypes(empty).dtypes.items())
+
+    normalization = {
+        "rating_scale": RATING_SCALE,
+        "rating_offset": RATING_OFFSET,
+        "max_game_time_limit_minutes": MAX_GAME_TIME_LIMIT_MINUTES,
+        "eco_cutoff": CUTOFF,
+        "player_window": PLAYER_WINDOW,
+    }
+    save_schema(
+        design_matrix_schema(columns, eco_vocabularies, eco_encoding, normalization),
+        output_path,
+    )
+
+
+def extract_features(
+    df,
+    eco_vocabularies,
+    eco_encoding="one-hot",
+    profiler=NULL_PROFILER,
+    player_history=None,
+):
+    # The design matrix is allocated up front, and every feature is written straight into its columns,
+    # leaving df untouched
+    # player_history, if given, holds the player history features of the games of df, in the same order
+    columns = design_matrix_columns(
+        eco_vocabularies, eco_encoding, player_history is not None
+    )
+    builder = DesignMatrixBuilder(len(df), columns, df.index)
+
+    # normalize ratings around 1500, with 1000 mapped to -1 and 2000 mapped to +1
+    with profiler.stage("ratings", df):
+        white_rating = df["white_rating"].to_numpy() / RATING_SCALE - RATING_OFFSET
+        black_rating = df["black_rating"].to_numpy() / RATING_SCALE - RATING_OFFSET
+        builder["rated"] = df["rated"].to_numpy()
+        builder["white_rating"] = white_rating
+        builder["black_rating"] = black_rating
+        builder["white_rating_advantage"] = white_rating - black_rating
+
+    # Compute approx time limit from the increment code and number of opening moves
+    with profiler.stage("time_limit", df):
+        builder["approx_time_limit_hours"] = (
+            approx_time_limit_minutes(
+                df["increment_code"], df["opening_ply"], MAX_GAME_TIME_LIMIT_MINUTES
+            )
+            / 60
+        )
+
+    # Add encodings of truncated versions of ECO codes for 1, 2, and 3 character versions
+    for chars in ECO_CHARS:
+        with profiler.stage(f"eco_{chars}", df):
+            vocabulary = eco_vocabularies[chars]
+            codes = truncated_eco_codes(df["opening_eco"], chars, vocabulary)
+            if eco_encoding == "codes":
+                builder[f"eco_{chars}"] = codes
+            else:
+                names = [f"eco_{chars}_{code}" for code in vocabulary]
+                builder.set_one_hot(names, codes)
+
+    # Extract month of year, day of week, and hour of day from the unix timestamp
+    with profiler.stage("time_components", df):
+        for column, values in time_component_columns(df["created_at"]).items():
+            builder[column] = values
+
+    if player_history is not None:
+        with profiler.stage("player_history", df):
+            for column in PLAYER_HISTORY_COLUMNS:
+                builder[column] = player_history[column].to_numpy()
+
+    # Add numerical encoding of game outcome
+    with profiler.stage("outcome", df):
+        builder["outcome"], builder["is_draw"] = game_outcome_columns(df["winner"])
+
+    with profiler.stage("assemble", df):
+        return builder.to_frame()
+
+
+def main(
+    input_path,
+    output_path,
+    chunk_size,
+    vocabulary_path,
+    frozen_vocabulary,
+    eco_encoding,
+    player_history=False,
+    profiler=NULL_PROFILER,
+):
+    # First pass: fit the ECO vocabulary over the whole file, unless a saved one should be reused
+    if frozen_vocabulary and os.path.exists(vocabulary_path):
+        eco_vocabularies = load_eco_vocabulary(vocabulary_path)
+    else:
+        with profiler.stage("fit_eco_vocabulary"):
+            eco_vocabularies = fit_eco_vocabularies(input_path, chunk_size)
+        save_eco_vocabulary(eco_vocabularies, vocabulary_path)
+
+    history = None
+    if player_history:
+        with profiler.stage("fit_player_history"):
+            history = fit_player_history(input_path, chunk_size)
+
+    # Second pass: featurize one chunk at a time, appending each to the final design matrix
+    seen_ids = GameIdIndex()
+    offset = 0
+    with DesignMatrixWriter(output_path) as writer:
+        for chunk in _iter_unique_game_chunks(
+            input_path, chunk_size, seen_ids, profiler
+        ):
+            chunk_history = None
+            if history is not None:
+                chunk_history = history.iloc[offset : offset + len(chunk)]
+                offset += len(chunk)
+            design_matrix = extract_features(
+                chunk, eco_vocabularies, eco_encoding, profiler, chunk_history
+            )
+            with profiler.stage("write", design_matrix):
+                writer.write(design_matrix)
+    save_design_matrix_schema(
+        output_path, eco_vocabularies, eco_encoding, player_history
+    )
+
+    return seen_ids
+
+
+def main_parallel(
+    input_path,
+    output_path,
+    partition_bytes,
+    vocabulary_path,
+    frozen_vocabulary,
+    eco_encoding,
+    workers,
+    player_history=False,
+    profiler=NULL_PROFILER,
+):
+    columns, byte_ranges = _csv_byte_ranges(input_path, partition_bytes, workers)
+    tasks = [(input_path, columns, byte_range) for byte_range in byte_ranges]
+    read_columns = ["id", "opening_eco"]
+    if player_history:
+        read_columns += PLAYER_HISTORY_SOURCE_COLUMNS
+
+    max_in_flight = TASKS_IN_FLIGHT_PER_WORKER * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # First pass: find the rows repeating an earlier game id, and count ECO codes over the rest
+        # Partitions come back in file order, so "earlier" means the same thing as in the serial version
+        seen_ids = GameIdIndex()
+        eco_counts = pd.Series(dtype="int64")
+        duplicate_rows = []
+        history_games = []
+        with profiler.stage("fit_eco_vocabulary"):
+            id_tasks = [task + (read_columns,) for task in tasks]
+            for partition in _imap_in_order(
+                pool, _read_partition_ids, id_tasks, max_in_flight
+            ):
+                keys = game_id_keys(partition["id"])
+                is_duplicate = (
+                    seen_ids.contains_keys(keys) | partition["id"].duplicated()
+                )
+                duplicate_rows.append(np.flatnonzero(is_duplicate))
+                partition = partition[~is_duplicate]
+                seen_ids.add_keys(keys[~is_duplicate])
+                eco_counts = eco_counts.add(
+                    partition["opening_eco"].value_counts(), fill_value=0
+                )
+                if player_history:
+                    history_games.append(partition[PLAYER_HISTORY_SOURCE_COLUMNS])
+
+        # Every partition gets the player history features of its unique games
+        histories = [None] * len(tasks)
+        if player_history:
+            with profiler.stage("fit_player_history"):
+                sizes = [len(games) for games in history_games]
+                history = player_history_features(
+                    pd.concat(history_games, ignore_index=True)
+                )
+                ends = np.cumsum(sizes)
+                histories = [
+                    history.iloc[end - size : end] for size, end in zip(sizes, ends)
+                ]
+
+        if frozen_vocabulary and os.path.exists(vocabulary_path):
+            eco_vocabularies = load_eco_vocabulary(vocabulary_path)
+        else:
+            eco_vocabularies = _fit_eco_vocabularies(eco_counts)
+            save_eco_vocabulary(eco_vocabularies, vocabulary_path)
+
+        # Second pass: workers featurize and encode whole partitions, which are appended in file order as they
+        # arrive, with at most max_in_flight of them encoded or being encoded at a time
+        # The stage times reported by workers add up across processes, so can exceed the wall time
+        with DesignMatrixWriter(output_path) as writer:
+            featurize_tasks = (
+                task
+                + (rows, eco_vocabularies, eco_encoding, writer.format)
+                + (history, profiler.enabled)
+                for task, rows, history in zip(tasks, duplicate_rows, histories)
+            )
+            for chunk, stages in _imap_in_order(
+                pool, _featurize_partition, featurize_tasks, max_in_flight
+            ):
+                profiler.merge(stages)
+                with profiler.stage("write"):
+                    writer.write_encoded(chunk)
+    save_design_matrix_schema(
+        output_path, eco_vocabularies, eco_encoding, player_history
+    )
+
+    return seen_ids
+
+
+def _save_incremental_state(state_path, state):
+    # Written next to the state and swapped in, so the state on disk is always one consistent checkpoint
+    with open(f"{state_path}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{state_path}.tmp", state_path)
+
+
+def main_incremental(
+    input_path,
+    output_path,
+    partition_bytes,
+    eco_encoding,
+    full_build,
+    profiler=NULL_PROFILER,
+):
+    state_path = f"{output_path}.state.json"
+    raw_size = os.path.getsize(input_path)
+
+    # Without any state, build everything (with full_build) and record how far the raw csv was processed
+    # The vocabulary the output was encoded with is kept in the state, as the shared one may be refitted later
+    if not os.path.exists(state_path):
+        processed_ids = full_build()
+        ids_path = f"{output_path}.ids.npy"
+        processed_ids.save(ids_path)
+        eco_vocabularies = schema_eco_vocabularies(load_schema(output_path))
+        _save_incremental_state(
+            state_path,
+            {
+                "byte_offset": raw_size,
+                "output_size": os.path.getsize(output_path),
+                "ids_path": ids_path,
+                "id_key_version": ID_KEY_VERSION,
+                "eco_encoding": eco_encoding,
+                "eco_vocabularies": {
+                    str(chars): codes for chars, codes in eco_vocabularies.items()
+                },
+            },
+        )
+        return
+
+    with open(state_path) as f:
+        state = json.load(f)
+    if state.get("id_key_version", 1) != ID_KEY_VERSION:
+        raise ValueError(
+            f"{state_path} refers to game ids hashed by an older version, "
+            "remove it to rebuild"
+        )
+    # States written before checkpoints, run files and vocabularies were recorded
+    state.setdefault("ids_path", f"{output_path}.ids.npy")
+    state.setdefault("ids_run_paths", [])
+    state.setdefault("output_size", os.path.getsize(output_path))
+    if "eco_vocabularies" not in state:
+        state["eco_vocabularies"] = load_schema(output_path)["eco_vocabularies"]
+    if state["eco_encoding"] != eco_encoding:
+        raise ValueError(
+            f"{output_path} was built with --eco-encoding {state['eco_encoding']}"
+        )
+    if raw_size < state["byte_offset"]:
+        raise ValueError(
+            f"{input_path} shrank since it was last processed, "
+            f"remove {state_path} to rebuild"
+        )
+    eco_vocabularies = {
+        int(chars): codes for chars, codes in state["eco_vocabularies"].items()
+    }
+    expected_columns = [
+        name for name, _ in design_matrix_columns(eco_vocabularies, eco_encoding)
+    ]
+    if read_design_matrix_header(output_path) != expected_columns:
+        raise ValueError(
+            f"{output_path} no longer has the columns it was incrementally built with, "
+            f"remove {state_path} to rebuild"
+        )
+
+    # Rows written after the last checkpoint, by a run that was interrupted, are rolled back
+    output_size = os.path.getsize(output_path)
+    if output_size < state["output_size"]:
+        raise ValueError(
+            f"{output_path} shrank since it was last processed, "
+            f"remove {state_path} to rebuild"
+        )
+    if output_size > state["output_size"]:
+        os.truncate(output_path, state["output_size"])
+    processed_ids = GameIdIndex(state["ids_path"], state["ids_run_paths"])
+
+    # Featurize only the rows after the watermark, skipping games that were already processed
+    columns, byte_ranges = _csv_byte_ranges(
+        input_path, partition_bytes, 1, start=state["byte_offset"]
+    )
+    with DesignMatrixWriter(output_path, append=True) as writer:
+        for byte_range in byte_ranges:
+            with profiler.stage("load") as stage:
+                df = _read_byte_range(input_path, columns, byte_range)
+                stage.rows_out = len(df)
+            with profiler.stage("dedup", df) as stage:
+                df = drop_duplicate_games(df, processed_ids)
+                stage.rows_out = len(df)
+            design_matrix = extract_features(
+                df, eco_vocabularies, eco_encoding, profiler
+            )
+            with profiler.stage("write", design_matrix):
+                writer.write(design_matrix)
+                writer.flush()
 
+            # Checkpoint after every partition, so a crash only ever repeats the partition it happened in
+            # Only the partition's new ids are written, to a run file of their own, so a checkpoint costs as
+            # much as the partition rather than as the whole history
+            with profiler.stage("checkpoint"):
+                start, end = byte_range
+                processed_ids.save_run(f"{output_path}.ids.{start}-{end}.npy")
+                state["byte_offset"] = end
+                state["output_size"] = os.path.getsize(output_path)
+                state["ids_run_paths"] = list(processed_ids.run_paths)
+                _save_incremental_state(state_path, state)
 
-# Add encodings of truncated versions of ECO codes for 1, 2, and 3 character versions
-# After which, the original ECO codes are no longer needed
-df = add_one_hot_encoding_for_truncated_eco_code(df, 1, CUTOFF)
-df = add_one_hot_encoding_for_truncated_eco_code(df, 2, CUTOFF)
-df = add_one_hot_encoding_for_truncated_eco_code(df, 3, CUTOFF)
-df.drop("opening_eco", axis=1, inplace=True)
+    # Merging the run files reads every saved id, so is only done once they pile up, at most once per run
+    # The ids file alternates between two names, so the one the state refers to is never overwritten
+    if len(state["ids_run_paths"]) > MAX_ID_RUN_FILES:
+        with profiler.stage("merge_ids"):
+            merged_paths = [state["ids_path"]] + state["ids_run_paths"]
+            ids_paths = [f"{output_path}.ids.npy", f"{output_path}.ids.next.npy"]
+            ids_path = next(p for p in ids_paths if p != state["ids_path"])
+            processed_ids.save(ids_path)
+            state["ids_path"] = ids_path
+            state["ids_run_paths"] = []
+            _save_incremental_state(state_path, state)
+            for path in merged_paths:
+                if os.path.exists(path):
+                    os.remove(path)
 
 
-# Extract month of year, day of week, and hour of day
-# Then remove the unix timestamp
-df = add_time_component_columns(df)
-df.drop("created_at", axis=1, inplace=True)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the design matrix from the raw chess games."
+    )
+    parser.add_argument("--input", default=RAW_GAMES_PATH)
+    parser.add_argument("--output", default=PROCESSED_GAMES_PATH)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--vocabulary", default=ECO_VOCABULARY_PATH)
+    parser.add_argument(
+        "--frozen-vocabulary",
+        action="store_true",
+        help="reuse the saved ECO vocabulary instead of refitting it",
+    )
+    parser.add_argument(
+        "--eco-encoding",
+        choices=["one-hot", "codes"],
+        default="one-hot",
+        help="store ECO truncations as one-hot columns or as integer vocabulary codes",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes featurizing byte ranges of the raw csv in parallel",
+    )
+    parser.add_argument("--partition-mb", type=int, default=PARTITION_MB)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only featurize games appended to the raw csv since the last incremental run",
+    )
+    parser.add_argument(
+        "--player-history",
+        action="store_true",
+        help="add features of both players' earlier games",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print the wall time, rows and memory delta of every stage",
+    )
+    parser.add_argument("--profile-report", help="save the stage report as JSON")
+    parser.add_argument("--cprofile", help="dump cProfile stats of the whole run")
+    parser.add_argument("--tracemalloc", help="dump a tracemalloc snapshot at exit")
+    args = parser.parse_args()
+    if args.player_history and args.incremental:
+        parser.error("--player-history can't be updated with --incremental")
+    if args.incremental and design_matrix_format(args.output) != "csv":
+        parser.error("--incremental can only append to a .csv --output")
 
+    profile = bool(
+        args.profile or args.profile_report or args.cprofile or args.tracemalloc
+    )
+    profiler = StageProfiler(args.cprofile, args.tracemalloc, enabled=profile)
 
-# Add numerical encoding of game outcome, and remove string encoding
-df = add_game_outcome_column(df)
-df.drop("winner", axis=1, inplace=True)
+    def build():
+        if args.workers > 1:
+            return main_parallel(
+                args.input,
+                args.output,
+                args.partition_mb * 2**20,
+                args.vocabulary,
+                args.frozen_vocabulary,
+                args.eco_encoding,
+                args.workers,
+                args.player_history,
+                profiler,
+            )
+        return main(
+            args.input,
+            args.output,
+            args.chunk_size,
+            args.vocabulary,
+            args.frozen_vocabulary,
+            args.eco_encoding,
+            args.player_history,
+            profiler,
+        )
 
+    with profiler:
+        if args.incremental:
+            main_incremental(
+                args.input,
+                args.output,
+                args.partition_mb * 2**20,
+                args.eco_encoding,
+                build,
+                profiler,
+            )
+        else:
+            build()
 
-# Save the final design matrix
-df.to_csv("./data/processed_chess_games.csv", index=False)
+    if args.profile_report:
+        profiler.save_report(args.profile_report)
+    if profile:
+        profiler.print_report()
@@ -7,10 +7,10 @@ Loads in the csv file and prints a variety of basic information:
 * Number of missing values
 """
 
-import pandas as pd
+from src.loading import load_raw_games
 
 # Load the dataset
-df = pd.read_csv("./data/chess_games.csv")
+df = load_raw_games()
 
 # Dataset shape
 print("Dataset shape:")
@@ -26,10 +26,10 @@ print(df.describe())
 
 # Unique values in categorical columns
 print("\nUnique values in categorical columns:")
-categorical_columns = df.select_dtypes(include=["object"]).columns
+categorical_columns = df.select_dtypes(include=["object", "string", "category"]).columns
 for col in categorical_columns:
     unique_vals = df[col].unique()
-    print(f"    {col:20s}: {len(unique_vals):5d}   {unique_vals[:3]}...")
+    print(f"    {col:20s}: {len(unique_vals):5d}   {list(unique_vals[:3])}...")
 
 # Check for missing values
 print("\nMissing values:")
@@ -1,12 +1,51 @@
+import argparse
+import os
+
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
 from scripts.position_analysis import CUTOFF
-from src.features import add_time_component_columns, add_truncated_eco_column
+from src.aggregates import (
+    CUBE_SOURCE_COLUMNS,
+    CUBE_VALUES,
+    OUTCOME_CUBE_PATH,
+    build_outcome_cube,
+    load_outcome_cube,
+    load_outcome_cube_source,
+    marginal,
+    outcome_shares,
+    save_outcome_cube,
+)
+from src.loading import RAW_GAMES_PATH, source_signature
+from src.query import GameQuery
+
+CHUNK_SIZE = 100_000
+RATING_BIN_WIDTH = 25
+
+
+def _rating_difference(df):
+    return df["white_rating"].astype("int32") - df["black_rating"]
+
+
+def _histplot(histogram, color, label):
+    # Plots a histogram counted by GameQuery.histogram, which has the left edge of every bin as index
+    bins = pd.DataFrame(
+        {"center": histogram.index + RATING_BIN_WIDTH / 2, "count": histogram}
+    )
+    sns.histplot(
+        data=bins,
+        x="center",
+        weights="count",
+        binwidth=RATING_BIN_WIDTH,
+        binrange=(histogram.index[0], histogram.index[-1] + RATING_BIN_WIDTH),
+        color=color,
+        kde=True,
+        label=label,
+    )
 
 
-def show_rating_analysis(df):
+def show_rating_analysis(games):
     # Rated vs Unrated Analysis
     plt.figure(figsize=(17, 6))
 
@@ -16,34 +55,49 @@ def show_rating_analysis(df):
         "draw": "#C04040",
         "black": "#3F3F3F",
     }
-    df["outcome_color"] = df["winner"].map(outcome_color_mapping)
-    df["rating_difference"] = df["white_rating"] - df["black_rating"]
-    df_rated = df[df["rated"] == True]
-    df_unrated = df[df["rated"] == False]
+    games = games.derive(
+        "rating_difference", ["white_rating", "black_rating"], _rating_difference
+    )
+    rated_games = games.where_rated(True)
+    unrated_games = games.where_rated(False)
 
     # Subplot for rated distribution
     plt.subplot(1, 5, 1)
-    sns.countplot(x="rated", data=df)
+    games_by_rated = games.value_counts("rated").sort_index()
+    sns.barplot(x=games_by_rated.index.astype(str), y=games_by_rated.to_numpy())
     plt.title("Rated Distribution")
+    plt.xlabel("rated")
+    plt.ylabel("count")
 
     # Subplots for winner distribution
     order = ["white", "black", "draw"]
-    plt.subplot(1, 5, 2)
-    sns.countplot(x="winner", data=df_rated, palette=outcome_color_mapping, order=order)
-    plt.title("Rated Winner Distribution")
+    for i, (query, title) in enumerate(
+        [(rated_games, "Rated"), (unrated_games, "Unrated")]
+    ):
+        plt.subplot(1, 5, 2 + i)
+        games_by_winner = query.value_counts("winner").reindex(order, fill_value=0)
+        sns.barplot(
+            x=order,
+            y=games_by_winner.to_numpy(),
+            hue=order,
+            palette=outcome_color_mapping,
+            legend=False,
+        )
+        plt.title(f"{title} Winner Distribution")
+        plt.xlabel("winner")
+        plt.ylabel("count")
 
-    plt.subplot(1, 5, 3)
-    sns.countplot(
-        x="winner", data=df_unrated, palette=outcome_color_mapping, order=order
-    )
-    plt.title("Unrated Winner Distribution")
+    # The scatter plots need the individual games, but only their ratings and winner
+    columns = ["white_rating", "black_rating", "winner"]
+    df_rated = rated_games.select(*columns).collect()
+    df_unrated = unrated_games.select(*columns).collect()
 
     # Subplot for scatter plot
     plt.subplot(1, 5, 4)
     plt.scatter(
         df_rated["white_rating"],
         df_rated["black_rating"],
-        c=df_rated["outcome_color"],
+        c=df_rated["winner"].map(outcome_color_mapping),
         s=3,
     )
     plt.xlabel("White Rating")
@@ -86,7 +140,7 @@ def show_rating_analysis(df):
     plt.scatter(
         df_unrated["white_rating"],
         df_unrated["black_rating"],
-        c=df_unrated["outcome_color"],
+        c=df_unrated["winner"].map(outcome_color_mapping),
         s=10,
     )
     plt.xlabel("White Rating")
@@ -130,38 +184,51 @@ def show_rating_analysis(df):
 
     # Analysis of game outcomes based on player ratings
     plt.figure(figsize=(17, 6))
+    # The distributions are counted into histograms by the query, rather than from the individual games
     plt.subplot(1, 3, 1)
-    sns.histplot(
-        df["white_rating"], color="blue", kde=True, label="White Player Rating"
+    _histplot(
+        games.histogram("white_rating", RATING_BIN_WIDTH),
+        "blue",
+        "White Player Rating",
+    )
+    _histplot(
+        games.histogram("black_rating", RATING_BIN_WIDTH),
+        "red",
+        "Black Player Rating",
     )
-    sns.histplot(df["black_rating"], color="red", kde=True, label="Black Player Rating")
     plt.title("Distribution of Player Ratings")
     plt.xlabel("Rating")
     plt.legend()
 
     plt.subplot(1, 3, 2)
-    sns.histplot(
-        df_rated["rating_difference"], color="red", kde=True, label="Rated games"
+    _histplot(
+        rated_games.histogram("rating_difference", RATING_BIN_WIDTH),
+        "red",
+        "Rated games",
     )
-    sns.histplot(
-        df_unrated["rating_difference"], color="blue", kde=True, label="Unrated games"
+    _histplot(
+        unrated_games.histogram("rating_difference", RATING_BIN_WIDTH),
+        "blue",
+        "Unrated games",
     )
     plt.title("Distribution of Rating Differences")
     plt.xlabel("Rating Difference")
     plt.legend()
 
     plt.subplot(1, 3, 3)
-    sns.histplot(
-        df_rated[df_rated["winner"] == "draw"]["rating_difference"],
-        color="red",
-        kde=True,
-        label="Rated games",
+    _histplot(
+        rated_games.where_winner("draw").histogram(
+            "rating_difference", RATING_BIN_WIDTH
+        ),
+        "red",
+        "Rated games",
     )
-    sns.histplot(
-        df_unrated[df_unrated["winner"] == "draw"]["rating_difference"],
-        color="blue",
-        kde=True,
-        label="Unrated games",
+    _histplot(
+        unrated_games.where_winner("draw").histogram(
+            "rating_difference", RATING_BIN_WIDTH
+        ),
+        "blue",
+        "Unrated games",
     )
     plt.title("Distribution of Rating Differences in Drawn Games")
     plt.xlabel("Rating Difference in Drawn Games")
@@ -171,121 +238,59 @@ def show_rating_analysis(df):
     plt.show()
 
 
-def show_time_analysis(df):
-    # Convert timestamps to datetime objects
-    df = add_time_component_columns(df)
-
-    outcome_mapping = {
-        "white": +1,
-        "draw": 0,
-        "black": -1,
-    }
-    df["outcome"] = df["winner"].map(outcome_mapping)
-
+def show_time_analysis(cube):
     plt.figure(figsize=(17, 8))
-    plt.subplot(2, 3, 1)
-    df.groupby("month_of_year").size().plot(kind="bar")
-    plt.title("Number of Games by Month of Year")
-
-    plt.subplot(2, 3, 2)
-    df.groupby("day_of_week").size().plot(kind="bar")
-    plt.title("Number of Games by Day of Week")
-
-    plt.subplot(2, 3, 3)
-    df.groupby("hour_of_day").size().plot(kind="bar")
-    plt.title("Number of Games by Hour of Day")
-    plt.xticks(rotation=0)
 
     # Define color mapping for winner
     winner_color_mapping = {"white": "skyblue", "black": "salmon", "draw": "lightgreen"}
 
-    # Plot histograms for outcome densities over day of week, month of year, and hour of day
-    game_counts = (
-        df.groupby(["month_of_year", "winner"]).size().reset_index(name="count")
-    )
-
-    # Group by month_of_year and calculate the sum of counts for each month
-    month_sums = game_counts.groupby("month_of_year")["count"].sum()
-
-    # Divide the count of each row by the sum of counts for its month
-    game_counts["normalized_count"] = game_counts.apply(
-        lambda row: row["count"] / month_sums[row["month_of_year"]], axis=1
-    )
-
-    # Histogram for month of year
-    plt.subplot(2, 3, 4)
-    for outcome, color in winner_color_mapping.items():
-        plt.scatter(
-            game_counts.loc[game_counts["winner"] == outcome, "month_of_year"],
-            game_counts.loc[game_counts["winner"] == outcome, "normalized_count"],
-            color=color,
-            label=outcome,
-        )
-    plt.title("Outcome Density by Month")
-    plt.xlabel("Month of Year")
-    plt.ylabel("Density")
-    plt.legend()
-
-    game_counts = df.groupby(["day_of_week", "winner"]).size().reset_index(name="count")
-
-    # Group by day_of_week and calculate the sum of counts for each day
-    day_sums = game_counts.groupby("day_of_week")["count"].sum()
-
-    # Divide the count of each row by the sum of counts for its day
-    game_counts["normalized_count"] = game_counts.apply(
-        lambda row: row["count"] / day_sums[row["day_of_week"]], axis=1
-    )
-
-    # Scatter plot for day of week
-    plt.subplot(2, 3, 5)
-    for outcome, color in winner_color_mapping.items():
-        plt.scatter(
-            game_counts.loc[game_counts["winner"] == outcome, "day_of_week"],
-            game_counts.loc[game_counts["winner"] == outcome, "normalized_count"],
-            color=color,
-            label=outcome,
-        )
-    plt.title("Outcome Density by Day of Week")
-    plt.xlabel("Day of Week")
-    plt.ylabel("Density")
-    plt.legend()
-
-    game_counts = df.groupby(["hour_of_day", "winner"]).size().reset_index(name="count")
-
-    # Group by hour_of_day and calculate the sum of counts for each hour
-    hour_sums = game_counts.groupby("hour_of_day")["count"].sum()
-
-    # Divide the count of each row by the sum of counts for its hour
-    game_counts["normalized_count"] = game_counts.apply(
-        lambda row: row["count"] / hour_sums[row["hour_of_day"]], axis=1
-    )
-
-    # Scatter plot for hour of day
-    plt.subplot(2, 3, 6)
-    for outcome, color in winner_color_mapping.items():
-        plt.scatter(
-            game_counts.loc[game_counts["winner"] == outcome, "hour_of_day"],
-            game_counts.loc[game_counts["winner"] == outcome, "normalized_count"],
-            color=color,
-            label=outcome,
-        )
-    plt.title("Outcome Density by Hour of Day")
-    plt.xlabel("Hour of Day")
-    plt.ylabel("Density")
-    plt.legend()
+    time_components = [
+        ("month_of_year", "Month of Year", "Month"),
+        ("day_of_week", "Day of Week", "Day of Week"),
+        ("hour_of_day", "Hour of Day", "Hour of Day"),
+    ]
+    for i, (dimension, label, title) in enumerate(time_components):
+        plt.subplot(2, 3, i + 1)
+        marginal(cube, [dimension])["count"].plot(kind="bar")
+        plt.title(f"Number of Games by {label}")
+        plt.xticks(rotation=0 if dimension == "hour_of_day" else 90)
+
+        # Scatter plots of the share of each outcome, out of the games in the same month, day, or hour
+        shares = outcome_shares(cube, dimension)
+        plt.subplot(2, 3, i + 4)
+        for outcome, color in winner_color_mapping.items():
+            plt.scatter(shares.index, shares[outcome], color=color, label=outcome)
+        plt.title(f"Outcome Density by {title}")
+        plt.xlabel(label)
+        plt.ylabel("Density")
+        plt.legend()
 
     plt.tight_layout()
     plt.gcf().canvas.manager.set_window_title("Effect of Start Time on Game Outcome")
     plt.show()
 
 
-def show_position_analysis(df, chars):
-    # Extract the first and second characters of ECO code
-    df, column_name = add_truncated_eco_column(df, chars, CUTOFF)
+def truncated_eco_marginal(cube, chars):
+    """
+    Sums the cube by ECO code truncated to chars characters, and winner, with the codes having fewer than
+    CUTOFF games grouped into "other" (as add_truncated_eco_column does).
+    """
+    by_prefix = marginal(cube, ["eco_prefix", "winner"]).reset_index()
+    truncated = by_prefix["eco_prefix"].astype(str).str[:chars]
+    games_by_eco = by_prefix.groupby(truncated)["count"].sum()
+    codes_to_keep = games_by_eco[games_by_eco >= CUTOFF].index
 
-    num_games_by_eco = (
-        df.groupby([column_name])[["id"]].size().reset_index(name="count")
-    )
+    column_name = f"eco_{chars}_chars"
+    by_prefix[column_name] = truncated.where(truncated.isin(codes_to_keep), "other")
+    return by_prefix.groupby([column_name, "winner"])[CUBE_VALUES].sum(), column_name
+
+
+def show_position_analysis(cube, chars):
+    # Sum the cube by the first characters of ECO code
+    by_eco_and_winner, column_name = truncated_eco_marginal(cube, chars)
+    by_eco = by_eco_and_winner.groupby(column_name).sum()
+
+    num_games_by_eco = by_eco["count"].reset_index()
 
     # Plot ECO code vs average player rating
     plt.figure(figsize=(15, 8))
@@ -303,14 +308,11 @@ def show_position_analysis(df, chars):
     plt.xticks(rotation=45)
     plt.legend().remove()
 
-    # Calculate average player ratings grouped ECO code
+    # Calculate average player ratings grouped ECO code, from the rating totals
     avg_ratings_by_eco = (
-        df.groupby([column_name])[["white_rating", "black_rating"]].mean().reset_index()
-    )
-
-    avg_ratings_by_eco["rating_mean"] = (
-        avg_ratings_by_eco["white_rating"] + avg_ratings_by_eco["black_rating"]
-    ) / 2
+        (by_eco["white_rating_sum"] + by_eco["black_rating_sum"])
+        / (2 * by_eco["count"])
+    ).reset_index(name="rating_mean")
 
     # Plot ECO code vs average player rating
     plt.subplot(2, 2, 2)
@@ -328,12 +330,8 @@ def show_position_analysis(df, chars):
     plt.legend().remove()
 
     # Calculate win and draw rates grouped by the first and second characters of ECO code
-    eco_outcomes = (
-        df.groupby([column_name])["winner"]
-        .value_counts(normalize=True)
-        .unstack()
-        .fillna(0)
-    )
+    eco_outcomes = by_eco_and_winner["count"].unstack(fill_value=0)
+    eco_outcomes = eco_outcomes.div(eco_outcomes.sum(axis=1), axis=0)
 
     # Plot ECO code vs likelihood of white win
     plt.subplot(2, 2, 3)
@@ -371,12 +369,37 @@ def show_position_analysis(df, chars):
     plt.show()
 
 
+def load_or_build_outcome_cube(games, cube_path, rebuild=False):
+    # Count the (deduplicated) games into the cube once, and reuse the saved cube until the raw games change
+    source = {"path": os.path.abspath(games.path), **source_signature(games.path)}
+    if not rebuild and os.path.exists(cube_path):
+        if load_outcome_cube_source(cube_path) == source:
+            return load_outcome_cube(cube_path)
+        print(f"{cube_path} is out of date with {games.path}, rebuilding it")
+
+    cube = build_outcome_cube(games.select(*CUBE_SOURCE_COLUMNS).iter_chunks())
+    save_outcome_cube(cube, cube_path, source)
+    return cube
+
+
 if __name__ == "__main__":
-    # Load the dataset
-    df = pd.read_csv("./data/chess_games.csv")
-    df.drop_duplicates(subset="id", keep="first", inplace=True)
+    parser = argparse.ArgumentParser(description="Plot how game outcomes vary.")
+    parser.add_argument("--input", default=RAW_GAMES_PATH)
+    parser.add_argument("--cube", default=OUTCOME_CUBE_PATH)
+    parser.add_argument(
+        "--rebuild-cube",
+        action="store_true",
+        help="recount the raw games into the outcome cube, e.g. after they changed",
+    )
+    args = parser.parse_args()
+
+    # Every analysis queries only the columns and games it needs, without loading the whole dataset
+    games = GameQuery(args.input, CHUNK_SIZE)
 
     # show that player ratings affect the game outcome
-    show_rating_analysis(df)
-    show_time_analysis(df)
-    show_position_analysis(df, 2)
+    show_rating_analysis(games)
+
+    # The other plots are derived from the outcome cube
+    cube = load_or_build_outcome_cube(games, args.cube, args.rebuild_cube)
+    show_time_analysis(cube)
+    show_position_analysis(cube, 2)
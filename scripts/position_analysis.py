@@ -1,17 +1,27 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 
-from src.features import add_truncated_eco_column
+from src.query import GameQuery
 
 CUTOFF = 100
 
 
-def show_games_by_code_before_and_after_cutoff(df, chars):
-    # Truncate ECO codes to the specified number of characters
-    df, column_name = add_truncated_eco_column(df, chars, 1)
+def truncated_eco_counts(games_by_eco, chars, size_cutoff):
+    """
+    Takes a Series of game counts indexed by full ECO code, and returns the counts by code truncated to chars
+    characters, with the codes of fewer than size_cutoff games counted as "other", like add_truncated_eco_column.
+    """
+    truncated_counts = games_by_eco.groupby(games_by_eco.index.str[:chars]).sum()
+    is_kept = truncated_counts >= size_cutoff
+    if not is_kept.all():
+        truncated_counts = truncated_counts[is_kept]
+        truncated_counts["other"] = games_by_eco.sum() - truncated_counts.sum()
+    return truncated_counts.sort_values(ascending=False)
 
-    # Count the number of games by truncated ECO code
-    games_by_eco = df[column_name].value_counts()
+
+def show_games_by_code_before_and_after_cutoff(games, chars):
+    # Count the number of games by full ECO code, then by truncated ECO code
+    games_by_full_eco = games.value_counts("opening_eco")
+    games_by_eco = truncated_eco_counts(games_by_full_eco, chars, 1)
 
     # Plot the results
     plt.figure(figsize=(12, 6))
@@ -23,9 +33,8 @@ def show_games_by_code_before_and_after_cutoff(df, chars):
     plt.xticks(rotation=45)  # Rotate x-axis tick labels for better readability
     plt.grid(axis="y", linestyle="--", alpha=0.7)
 
-    # Truncate ECO codes to the specified number of characters
-    df, column_name = add_truncated_eco_column(df, chars, CUTOFF)
-    games_by_eco_trunc = df[column_name].value_counts()
+    # Truncate ECO codes, counting those below the cutoff as "other"
+    games_by_eco_trunc = truncated_eco_counts(games_by_full_eco, chars, CUTOFF)
 
     # Plot the results
     plt.subplot(2, 1, 2)
@@ -42,10 +51,9 @@ def show_games_by_code_before_and_after_cutoff(df, chars):
 
 
 if __name__ == "__main__":
-    # Load the dataset
-    df = pd.read_csv("./data/chess_games.csv")
-    df.drop_duplicates(subset="id", keep="first", inplace=True)
+    # Every plot only needs the (deduplicated) games counted by ECO code
+    games = GameQuery()
 
-    show_games_by_code_before_and_after_cutoff(df, 3)
-    show_games_by_code_before_and_after_cutoff(df, 2)
-    show_games_by_code_before_and_after_cutoff(df, 1)
+    show_games_by_code_before_and_after_cutoff(games, 3)
+    show_games_by_code_before_and_after_cutoff(games, 2)
+    show_games_by_code_before_and_after_cutoff(games, 1)
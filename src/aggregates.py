@@ -0,0 +1,182 @@
+"""
+Source file for the precomputed outcome cube.
+
+The exploratory plots in scripts/outcome_analysis.py only ever need game counts (and rating totals) broken down
+by a few low-cardinality attributes, so rather than grouping the raw games again for every figure, the games are
+counted once into a cube with one row per combination of
+
+    winner x month of year x day of week x hour of day x ECO prefix x rated x rating difference bucket
+
+that occurs, holding the number of games and the sums of the white and black ratings. The cube is built one
+chunk of games at a time, and its size is bounded by the number of combinations rather than by the number of
+games. Dimensions are stored as small ints and categoricals, in a compressed .npz file.
+
+Coarser breakdowns are sums over the cube (see marginal), and means are rating sums divided by counts.
+
+The saved cube records the path, size and modification time of the raw games it was counted from (see
+load_outcome_cube_source), so that it can be rebuilt once games are appended to them.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.features import time_component_columns
+
+OUTCOME_CUBE_PATH = "./data/outcome_cube.npz"
+
+# ECO codes are kept to 3 characters, which every shorter truncation can be derived from
+ECO_PREFIX_CHARS = 3
+RATING_BUCKET_WIDTH = 100
+
+CUBE_DIMENSIONS = [
+    "winner",
+    "month_of_year",
+    "day_of_week",
+    "hour_of_day",
+    "eco_prefix",
+    "rated",
+    "rating_difference_bucket",
+]
+CUBE_VALUES = ["count", "white_rating_sum", "black_rating_sum"]
+CUBE_DTYPES = {
+    "winner": "category",
+    "month_of_year": "uint8",
+    "day_of_week": "uint8",
+    "hour_of_day": "uint8",
+    "eco_prefix": "category",
+    "rated": "bool",
+    "rating_difference_bucket": "int16",
+    "count": "int64",
+    "white_rating_sum": "int64",
+    "black_rating_sum": "int64",
+}
+
+# The raw columns the cube is built from
+CUBE_SOURCE_COLUMNS = [
+    "rated",
+    "created_at",
+    "winner",
+    "white_rating",
+    "black_rating",
+    "opening_eco",
+]
+
+
+def _eco_prefixes(opening_eco):
+    # Truncate each distinct ECO code once, with missing codes becoming ""
+    positions, unique_codes = pd.factorize(opening_eco)
+    prefixes = [str(code)[:ECO_PREFIX_CHARS] for code in unique_codes]
+    return np.array(prefixes + [""], dtype=object)[positions]
+
+
+def _cube_chunk(df):
+    # Count one chunk of raw games into (a part of) the cube
+    white_rating = df["white_rating"].to_numpy().astype(np.int64)
+    black_rating = df["black_rating"].to_numpy().astype(np.int64)
+    keys = pd.DataFrame(
+        {
+            "winner": df["winner"].to_numpy(),
+            **time_component_columns(df["created_at"]),
+            "eco_prefix": _eco_prefixes(df["opening_eco"]),
+            "rated": df["rated"].to_numpy(),
+            # Lower bound of the bucket, so -150 falls in -200 and +150 in +100
+            "rating_difference_bucket": (white_rating - black_rating)
+            // RATING_BUCKET_WIDTH
+            * RATING_BUCKET_WIDTH,
+            "white_rating_sum": white_rating,
+            "black_rating_sum": black_rating,
+        },
+        index=df.index,
+    )
+
+    grouped = keys.groupby(CUBE_DIMENSIONS, observed=True, sort=False)
+    cube = grouped[["white_rating_sum", "black_rating_sum"]].sum()
+    cube.insert(0, "count", grouped.size())
+    return cube.reset_index()
+
+
+def _merge_cubes(cubes):
+    cube = pd.concat(cubes, ignore_index=True)
+    return (
+        cube.groupby(CUBE_DIMENSIONS, observed=True, sort=False)[CUBE_VALUES]
+        .sum()
+        .reset_index()
+    )
+
+
+def build_outcome_cube(chunks):
+    """
+    Counts an iterable of DataFrames of raw games (with the CUBE_SOURCE_COLUMNS) into the outcome cube.
+
+    Returns the cube as a DataFrame with one row per occurring combination of CUBE_DIMENSIONS.
+    """
+    # Chunk cubes are merged in batches, once they hold as many rows as the merged cube, which keeps
+    # both the memory held and the total merging work proportional to the size of the cube
+    cube = pd.DataFrame(columns=CUBE_DIMENSIONS + CUBE_VALUES)
+    pending = []
+    pending_rows = 0
+    for chunk in chunks:
+        pending.append(_cube_chunk(chunk))
+        pending_rows += len(pending[-1])
+        if pending_rows >= len(cube):
+            cube = _merge_cubes([cube] + pending)
+            pending = []
+            pending_rows = 0
+
+    if pending:
+        cube = _merge_cubes([cube] + pending)
+    return cube.astype(CUBE_DTYPES)
+
+
+def save_outcome_cube(cube, path=OUTCOME_CUBE_PATH, source=None):
+    # Categoricals are stored as their codes, along with their categories
+    arrays = {"source": np.array(json.dumps(source))}
+    for column in CUBE_DIMENSIONS + CUBE_VALUES:
+        if isinstance(cube[column].dtype, pd.CategoricalDtype):
+            arrays[column] = cube[column].cat.codes.to_numpy()
+            arrays[f"{column}_categories"] = np.asarray(
+                cube[column].cat.categories, dtype=str
+            )
+        else:
+            arrays[column] = cube[column].to_numpy()
+
+    np.savez_compressed(path, **arrays)
+
+
+def load_outcome_cube(path=OUTCOME_CUBE_PATH):
+    with np.load(path) as arrays:
+        columns = {}
+        for column in CUBE_DIMENSIONS + CUBE_VALUES:
+            if f"{column}_categories" in arrays:
+                columns[column] = pd.Categorical.from_codes(
+                    arrays[column], arrays[f"{column}_categories"]
+                )
+            else:
+                columns[column] = arrays[column]
+
+    return pd.DataFrame(columns)
+
+
+def load_outcome_cube_source(path=OUTCOME_CUBE_PATH):
+    # The source recorded by save_outcome_cube, or None for cubes saved without one
+    with np.load(path) as arrays:
+        if "source" not in arrays:
+            return None
+        return json.loads(arrays["source"].item())
+
+
+def marginal(cube, dimensions):
+    """
+    Sums the cube over every dimension but the given ones, returning the values indexed by those dimensions.
+    """
+    return cube.groupby(dimensions, observed=True)[CUBE_VALUES].sum()
+
+
+def outcome_shares(cube, dimension):
+    """
+    Returns the share of white wins, black wins and draws for each value of dimension, one column per winner.
+    """
+    counts = marginal(cube, [dimension, "winner"])["count"].unstack(fill_value=0)
+    return counts.div(counts.sum(axis=1), axis=0)
@@ -0,0 +1,221 @@
+"""
+Source file for walk-forward backtests of the outcome models.
+
+A random train/test split lets a model learn from games played after the ones it is tested on, which production
+never can. walk_forward instead sorts the games by created_at and steps through time in windows of window_days,
+like a daily retraining job: before each window the model is updated with the games played before it (the last
+train_days of them, or all of them), and then tested on the games of the window.
+
+How the model is updated is up to an updater, which is what the backtest compares:
+* Refit fits a new model from scratch on the whole training window, every time
+* WarmStartForest fits a random forest once, then only adds trees fitted on the games since its last update,
+  dropping the oldest trees to keep the forest at a fixed size, so the forest rolls forward with the data
+* WarmStartLogisticRegression refits a logistic regression on the whole training window, but starting from the
+  previous coefficients, so the solver needs far fewer iterations
+
+Every update is timed, in wall time and CPU time, next to the accuracy on the window it was followed by.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score
+
+from src.dedup import GameIdIndex, drop_duplicate_games
+from src.loading import load_raw_games
+from src.online_learning import OUTCOME_CLASSES
+from src.timestamps import MS_PER_DAY, decode_timestamps
+
+
+def design_matrix_created_at(raw_path, chunk_size=100_000):
+    """
+    Returns the created_at of every row of a design matrix built from the raw games at raw_path, decoded into
+    int64 milliseconds.
+
+    extract_features keeps the first game with each id, in file order, so deduplicating the raw games the same
+    way lines them up with the rows of the design matrix.
+    """
+    seen_ids = GameIdIndex()
+    chunks = load_raw_games(
+        raw_path, columns=["id", "created_at"], chunksize=chunk_size
+    )
+    return decode_timestamps(
+        np.concatenate(
+            [
+                drop_duplicate_games(chunk, seen_ids)["created_at"].to_numpy()
+                for chunk in chunks
+            ]
+        )
+    )
+
+
+def _has_every_class(y):
+    return np.isin(OUTCOME_CLASSES, y).all()
+
+
+def _model_size(model):
+    # The number of trees of a forest, or the number of solver iterations of a linear model
+    if hasattr(model, "estimators_"):
+        return len(model.estimators_)
+    return int(np.max(model.n_iter_))
+
+
+class Refit:
+    """
+    Fits a clone of estimator from scratch on the training window at every update.
+    """
+
+    def __init__(self, estimator):
+        self.estimator = estimator
+        self.model = None
+
+    def update(self, X_train, y_train, X_new, y_new):
+        self.model = clone(self.estimator).fit(X_train, y_train)
+        return True
+
+
+class WarmStartForest:
+    """
+    Fits a random forest on the first training window, and from then on replaces its trees_per_update oldest
+    trees with new ones fitted on the games since the last update, keeping at most max_trees.
+    """
+
+    def __init__(self, estimator, trees_per_update=10, max_trees=None):
+        self.estimator = estimator
+        self.trees_per_update = trees_per_update
+        self.max_trees = max_trees or estimator.n_estimators
+        self.model = None
+
+    def update(self, X_train, y_train, X_new, y_new):
+        if self.model is None:
+            self.model = clone(self.estimator).set_params(warm_start=True)
+            self.model.fit(X_train, y_train)
+            return True
+
+        # Trees fitted without some outcome wouldn't line up with the others, so wait for more games
+        if not _has_every_class(y_new):
+            return False
+
+        # Drop the oldest trees, then fit new ones on the new games only
+        keep = self.max_trees - self.trees_per_update
+        self.model.estimators_ = self.model.estimators_[-keep:] if keep > 0 else []
+        self.model.n_estimators = len(self.model.estimators_) + self.trees_per_update
+        self.model.fit(X_new, y_new)
+        return True
+
+
+class WarmStartLogisticRegression:
+    """
+    Refits a logistic regression on the training window at every update, starting from the previous coefficients.
+    """
+
+    def __init__(self, estimator):
+        self.estimator = estimator
+        self.model = None
+
+    def update(self, X_train, y_train, X_new, y_new):
+        if self.model is None:
+            self.model = clone(self.estimator).set_params(warm_start=True)
+        elif not _has_every_class(y_train):
+            return False
+        self.model.fit(X_train, y_train)
+        return True
+
+
+UPDATERS = {
+    ("random_forest", "refit"): lambda: Refit(
+        RandomForestClassifier(n_estimators=100, random_state=42)
+    ),
+    ("random_forest", "warm"): lambda: WarmStartForest(
+        RandomForestClassifier(n_estimators=100, random_state=42)
+    ),
+    ("logistic_regression", "refit"): lambda: Refit(LogisticRegression(max_iter=1000)),
+    ("logistic_regression", "warm"): lambda: WarmStartLogisticRegression(
+        LogisticRegression(max_iter=1000)
+    ),
+}
+
+
+def walk_forward(
+    updater,
+    X,
+    y,
+    created_at,
+    window_days=1,
+    train_days=None,
+    min_train_rows=2000,
+):
+    """
+    Walks forward through the games in windows of window_days, updating the model with updater before each and
+    testing it on the window, and returns a DataFrame with one row per window.
+
+    X (array or sparse matrix) and y hold the games in any order, and created_at their creation times in
+    milliseconds. The first window starts once min_train_rows games have been played.
+    """
+    order = np.argsort(created_at, kind="stable")
+    times = np.asarray(created_at)[order]
+    X, y = X[order], np.asarray(y)[order]
+
+    window = window_days * MS_PER_DAY
+    # Windows start at midnight (UTC), like a daily job would
+    first = times[min(min_train_rows, len(times) - 1)]
+    first = np.ceil(first / MS_PER_DAY) * MS_PER_DAY
+    edges = np.arange(first, times[-1] + window, window)
+    bounds = np.searchsorted(times, edges)
+
+    rows = []
+    updated_until = 0
+    for start, end, edge in zip(bounds[:-1], bounds[1:], edges[:-1]):
+        if start == end:
+            continue
+        train_start = 0
+        if train_days is not None:
+            train_start = np.searchsorted(times, edge - train_days * MS_PER_DAY)
+        new_start = max(updated_until, train_start)
+
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        updated = updater.update(
+            X[train_start:start],
+            y[train_start:start],
+            X[new_start:start],
+            y[new_start:start],
+        )
+        fit_seconds = time.perf_counter() - start_wall
+        fit_cpu_seconds = time.process_time() - start_cpu
+        if updated:
+            updated_until = start
+
+        y_pred = updater.model.predict(X[start:end])
+        rows.append(
+            {
+                "window_start": pd.to_datetime(edge, unit="ms"),
+                "train_rows": start - train_start,
+                "new_rows": start - new_start,
+                "test_rows": end - start,
+                "accuracy": accuracy_score(y[start:end], y_pred),
+                "updated": updated,
+                "fit_seconds": fit_seconds,
+                "fit_cpu_seconds": fit_cpu_seconds,
+                "model_size": _model_size(updater.model),
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
+def summarize_backtest(windows):
+    """
+    Sums up a walk_forward result: accuracy over all tested games, and the total and per-window fit cost.
+    """
+    return {
+        "windows": len(windows),
+        "test_rows": int(windows["test_rows"].sum()),
+        "accuracy": np.average(windows["accuracy"], weights=windows["test_rows"]),
+        "fit_seconds": windows["fit_seconds"].sum(),
+        "fit_cpu_seconds": windows["fit_cpu_seconds"].sum(),
+        "fit_cpu_seconds_per_window": windows["fit_cpu_seconds"].mean(),
+    }
@@ -0,0 +1,155 @@
+"""
+Source file for deduplicating games by id.
+
+The raw exports contain repeated games, which are identified by their "id". Keeping every id seen so far in a
+Python set costs tens of bytes per game, so GameIdIndex instead keeps 8-byte integer keys in sorted NumPy arrays.
+An index can be saved to a .npy file, and is memory-mapped when loaded again, so checking a chunk of ids against
+the whole history never requires reading all of it into memory. Keys added later can be saved to run files of
+their own (save_run), which costs as much as the new keys, rather than rewriting the whole index (save).
+
+Keys are 64-bit hashes of the ids (pd.util.hash_array, which is vectorized and the same in every process). Two
+distinct ids share a key with a probability of about n**2 / 2**65 for n games, about 3 in a million for 10M
+games, in which case the later one would be dropped as a duplicate. Indexes saved to disk are only valid for
+the ID_KEY_VERSION they were built with.
+
+Where all the games are already in memory, drop_duplicate_games without an index just uses pandas.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bumped whenever the keys of game_id_keys change, so saved indexes of older keys can be told apart
+ID_KEY_VERSION = 2
+
+
+def _merge_runs(a, b):
+    # Merges two sorted runs of distinct keys; a stable sort finds the two runs and merges them in linear time,
+    # which is far cheaper than np.union1d's hash-based unique
+    return np.sort(np.concatenate([a, b]), kind="stable")
+
+
+def _save_keys(path, keys):
+    # Write next to the file and swap it in, so a failed save never leaves a truncated file behind
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, keys)
+    os.replace(tmp_path, path)
+
+
+def _hash_ids(ids):
+    # Ids are nearly all distinct, so hashing them as is beats factorizing them first (categorize=True)
+    return pd.util.hash_array(np.asarray(ids, dtype=object), categorize=False)
+
+
+def game_id_keys(ids):
+    """
+    Takes a sequence of game ids and returns their uint64 keys.
+    """
+    if isinstance(getattr(ids, "dtype", None), pd.CategoricalDtype):
+        # Hash every category once, unless there are more categories than ids (e.g. from the columnar store)
+        codes = ids.cat.codes.to_numpy()
+        categories = ids.cat.categories
+        if len(categories) <= len(codes):
+            return _hash_ids(categories)[codes]
+        return _hash_ids(categories.take(codes))
+    return _hash_ids(ids)
+
+
+class GameIdIndex:
+    """
+    Set of game ids, held as sorted runs of uint64 keys.
+
+    New keys are added as a sorted run, which is merged with the most recent runs whenever those aren't larger,
+    so adding n keys costs O(n log n) overall and there are only ever O(log n) runs to search. The keys loaded
+    from disk, from the index file at path and the run files at run_paths, are memory-mapped and only read when
+    searched or merged by save.
+    """
+
+    def __init__(self, path=None, run_paths=()):
+        self.path = path
+        self.run_paths = list(run_paths)
+        self._saved_keys = np.empty(0, dtype=np.uint64)
+        self._saved_runs = [np.load(p, mmap_mode="r") for p in self.run_paths]
+        self._runs = []
+
+        if path is not None and os.path.exists(path):
+            self._saved_keys = np.load(path, mmap_mode="r")
+
+    def __len__(self):
+        runs = [self._saved_keys] + self._saved_runs + self._runs
+        return sum(len(run) for run in runs)
+
+    def contains_keys(self, keys):
+        # Searching for sorted keys walks every run in order, which keeps the lookups cache friendly
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        found = np.zeros(len(keys), dtype=bool)
+        for run in [self._saved_keys] + self._saved_runs + self._runs:
+            if len(run):
+                positions = np.searchsorted(run, sorted_keys).clip(max=len(run) - 1)
+                found[order] |= run[positions] == sorted_keys
+        return found
+
+    def contains(self, ids):
+        return self.contains_keys(game_id_keys(ids))
+
+    def add_keys(self, keys):
+        # Keys are assumed to not be in the index already, as with what drop_duplicate_games adds
+        run = np.sort(keys)
+        run = run[np.append(True, run[1:] != run[:-1])] if len(run) else run
+        while self._runs and len(self._runs[-1]) <= len(run):
+            run = _merge_runs(self._runs.pop(), run)
+        self._runs.append(run)
+
+    def add(self, ids):
+        self.add_keys(game_id_keys(ids))
+
+    def save_run(self, path):
+        """
+        Saves the keys added since the index was loaded or last saved to a run file of their own at path, leaving
+        the files saved before untouched. Does nothing if no keys were added.
+        """
+        if not self._runs:
+            return
+        keys = self._runs[0]
+        for run in self._runs[1:]:
+            keys = _merge_runs(keys, run)
+
+        _save_keys(path, keys)
+        self.run_paths.append(path)
+        self._saved_runs.append(np.load(path, mmap_mode="r"))
+        self._runs = []
+
+    def save(self, path=None):
+        """
+        Merges every key, saved or not, into a single index file at path. This reads the whole index.
+        """
+        path = path or self.path
+        keys = self._saved_keys
+        for run in self._saved_runs + self._runs:
+            keys = _merge_runs(keys, run)
+
+        _save_keys(path, keys)
+        self.path = path
+        self.run_paths = []
+        self._saved_keys = np.load(path, mmap_mode="r")
+        self._saved_runs = []
+        self._runs = []
+
+
+def drop_duplicate_games(df, index=None):
+    """
+    Drops games repeating an earlier game id in df, keeping the first, like
+    df.drop_duplicates(subset="id", keep="first").
+
+    If a GameIdIndex is given, games already in it are dropped too, and the ids of the kept games are added to it.
+    """
+    if index is None:
+        return df.drop_duplicates(subset="id", keep="first")
+
+    keys = game_id_keys(df["id"])
+    is_duplicate = pd.Series(keys).duplicated().to_numpy() | index.contains_keys(keys)
+    index.add_keys(keys[~is_duplicate])
+
+    return df[~is_duplicate]
@@ -0,0 +1,426 @@
+"""
+Source file for reading and writing the processed design matrix.
+
+The design matrix can be stored as CSV, or in a typed columnar format (Parquet or Feather) chosen by the file
+extension. The columnar formats store one-hot and boolean columns as int8, ratings and time limits as float32,
+and time components as uint8, and are compressed. They also let readers load only the columns they need.
+pyarrow is only required when reading or writing the columnar formats.
+
+When the ECO blocks are stored as compact codes (one "eco_{chars}" column per truncation, see
+add_eco_code_column), load_features_and_target expands them into a scipy.sparse CSR matrix instead of dense
+one-hot columns, which both of our models accept directly. Models with native categorical support instead
+load the codes as they are with load_eco_code_features_and_target, which also recovers them from one-hot columns.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.player_history import PLAYER_HISTORY_COLUMNS, PLAYER_HISTORY_STATISTICS
+
+COLUMNAR_FORMATS = {".parquet": "parquet", ".feather": "feather"}
+COMPRESSION = "zstd"
+
+FLOAT_COLUMNS = [
+    "white_rating",
+    "black_rating",
+    "white_rating_advantage",
+    "approx_time_limit_hours",
+    "white_recent_score",
+    "white_rating_trend",
+    "black_recent_score",
+    "black_rating_trend",
+]
+TIME_COMPONENT_COLUMNS = ["month_of_year", "day_of_week", "hour_of_day"]
+INT8_COLUMNS = ["rated", "outcome", "is_draw"]
+INT8_PREFIXES = ("eco_",)
+ECO_CODE_COLUMNS = ["eco_1", "eco_2", "eco_3"]
+
+
+def design_matrix_columns(
+    eco_vocabularies, eco_encoding="one-hot", player_history=False
+):
+    """
+    Returns the (name, dtype) of every column of the design matrix extract_features produces, in order. The
+    models are trained on the columns in this order, and FeaturePipeline produces its rows in it.
+    """
+    columns = [
+        ("rated", "int8"),
+        ("white_rating", "float64"),
+        ("black_rating", "float64"),
+        ("white_rating_advantage", "float64"),
+        ("approx_time_limit_hours", "float64"),
+    ]
+    for chars in sorted(eco_vocabularies):
+        if eco_encoding == "codes":
+            columns.append((f"eco_{chars}", "int16"))
+        else:
+            columns += [
+                (f"eco_{chars}_{code}", "int8") for code in eco_vocabularies[chars]
+            ]
+    columns += [
+        ("month_of_year", "uint8"),
+        ("day_of_week", "uint8"),
+        ("hour_of_day", "uint8"),
+    ]
+    if player_history:
+        columns += [
+            (column, PLAYER_HISTORY_STATISTICS[column.split("_", 1)[1]])
+            for column in PLAYER_HISTORY_COLUMNS
+        ]
+    columns += [
+        ("outcome", "int8"),
+        ("is_draw", "int8"),
+    ]
+    return columns
+
+
+def design_matrix_format(path):
+    return COLUMNAR_FORMATS.get(os.path.splitext(path)[1], "csv")
+
+
+def cast_design_matrix_dtypes(df):
+    # Downcast every column to the narrowest type that holds its values
+    dtypes = {}
+    for column in df.columns:
+        if column in ECO_CODE_COLUMNS:
+            dtypes[column] = "int16"
+        elif column in FLOAT_COLUMNS:
+            dtypes[column] = "float32"
+        elif column in TIME_COMPONENT_COLUMNS:
+            dtypes[column] = "uint8"
+        elif column in INT8_COLUMNS or column.startswith(INT8_PREFIXES):
+            dtypes[column] = "int8"
+
+    return df.astype(dtypes)
+
+
+def encode_design_matrix_chunk(df, file_format):
+    """
+    Converts a chunk of the design matrix into what DesignMatrixWriter.write_encoded expects for file_format.
+
+    This is split out from writing so that the (expensive) encoding can happen in worker processes.
+    CSV chunks become text including a header line, columnar chunks become a typed pyarrow Table.
+    """
+    if file_format == "csv":
+        return df.to_csv(index=False)
+
+    import pyarrow as pa
+
+    return pa.Table.from_pandas(cast_design_matrix_dtypes(df), preserve_index=False)
+
+
+class DesignMatrixBuilder:
+    """
+    Preallocated design matrix, whose columns are filled in one at a time.
+
+    columns lists (name, dtype) pairs in their final order. Each run of consecutive columns with the same dtype
+    is allocated as a single 2D block, in the column-major layout pandas keeps its blocks in, so filling a column
+    writes into contiguous memory and to_frame wraps the blocks into a DataFrame without copying them.
+    """
+
+    def __init__(self, n_rows, columns, index=None):
+        self.index = index
+        self._blocks = []
+        self._locations = {}
+
+        for name, dtype in columns:
+            if not self._blocks or self._blocks[-1][1] != np.dtype(dtype):
+                self._blocks.append(([], np.dtype(dtype)))
+            self._locations[name] = (len(self._blocks) - 1, len(self._blocks[-1][0]))
+            self._blocks[-1][0].append(name)
+
+        # Zero-filled, so one-hot blocks only need their ones set
+        self._blocks = [
+            (names, np.zeros((len(names), n_rows), dtype=dtype))
+            for names, dtype in self._blocks
+        ]
+
+    def __setitem__(self, name, values):
+        block, position = self._locations[name]
+        self._blocks[block][1][position] = values
+
+    def set_one_hot(self, names, codes):
+        """
+        Sets column names[code] to 1 in each row, for the consecutive columns names. Rows with code -1 are left
+        at 0.
+        """
+        block, first = self._locations[names[0]]
+        rows = np.flatnonzero(codes != -1)
+        self._blocks[block][1][first + codes[rows], rows] = 1
+
+    def to_frame(self):
+        frames = [
+            pd.DataFrame(values.T, columns=names, index=self.index, copy=False)
+            for names, values in self._blocks
+        ]
+        return pd.concat(frames, axis=1) if len(frames) > 1 else frames[0]
+
+
+class DesignMatrixWriter:
+    """
+    Writes a design matrix one chunk at a time, in the format given by the extension of path.
+
+    Use as a context manager, calling write() once per chunk. Every chunk must have the same columns.
+    With append=True, chunks are added to the end of an existing CSV design matrix with the same columns.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.format = design_matrix_format(path)
+        self.append = append
+        self._writer = None
+        self._schema = None
+
+        if append and self.format != "csv":
+            raise ValueError(f"Appending is only supported for CSV, not {self.format}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, df):
+        self.write_encoded(encode_design_matrix_chunk(df, self.format))
+
+    def write_encoded(self, chunk):
+        if self.format == "csv":
+            # Only the first chunk of a new file keeps its header line
+            if self._writer is None:
+                mode = "a" if self.append else "w"
+                self._writer = open(self.path, mode, newline="")
+            if self.append or self._writer.tell() > 0:
+                chunk = chunk.partition("\n")[2]
+            self._writer.write(chunk)
+            return
+
+        if self._writer is None:
+            self._schema = chunk.schema
+            self._writer = self._open_columnar_writer(chunk.schema)
+        self._writer.write_table(chunk.cast(self._schema))
+
+    def flush(self):
+        # Makes the CSV written so far durable, e.g. before recording how far the output got
+        if self.format == "csv" and self._writer is not None:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+
+    def _open_columnar_writer(self, schema):
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetWriter(self.path, schema, compression=COMPRESSION)
+
+        # Feather V2 is the Arrow IPC file format, which can be written incrementally
+        import pyarrow.ipc as ipc
+
+        options = ipc.IpcWriteOptions(compression=COMPRESSION)
+        return ipc.new_file(self.path, schema, options=options)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def read_design_matrix(path, columns=None):
+    # Only the requested columns are read from disk
+    file_format = design_matrix_format(path)
+    if file_format == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    if file_format == "feather":
+        return pd.read_feather(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def read_design_matrix_header(path):
+    # Column names, without reading any rows
+    file_format = design_matrix_format(path)
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+    if file_format == "feather":
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def eco_one_hot_to_codes(df, eco_vocabularies):
+    """
+    Inverse of the one-hot encoding: takes a DataFrame with the "eco_{chars}_{code}" one-hot columns of the
+    vocabularies, and returns a DataFrame with one "eco_{chars}" code column per truncation, as
+    add_eco_code_column produces. Rows with no one-hot column set get -1.
+    """
+    codes = {}
+    for chars, vocabulary in sorted(eco_vocabularies.items()):
+        one_hot = df[[f"eco_{chars}_{code}" for code in vocabulary]].to_numpy()
+        block_codes = one_hot.argmax(axis=1).astype(np.int16)
+        block_codes[one_hot.max(axis=1) == 0] = -1
+        codes[f"eco_{chars}"] = block_codes
+
+    return pd.DataFrame(codes, index=df.index)
+
+
+def cap_eco_codes(df, eco_vocabularies, max_categories):
+    """
+    Takes a DataFrame with "eco_{chars}" code columns and the vocabularies they index into, and keeps at most
+    max_categories codes per truncation: the ones most frequent in df, with the rest folded into "other".
+
+    Returns a copy of df with the codes remapped, and the capped vocabularies (sorted, with "other" last).
+    Vocabularies already within max_categories are left as they are.
+    """
+    df = df.copy()
+    capped_vocabularies = {}
+    for chars, vocabulary in sorted(eco_vocabularies.items()):
+        if len(vocabulary) <= max_categories:
+            capped_vocabularies[chars] = vocabulary
+            continue
+
+        column = f"eco_{chars}"
+        codes = df[column].to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(vocabulary))
+        candidates = np.array(
+            [i for i, code in enumerate(vocabulary) if code != "other"]
+        )
+        # The most frequent codes, ties going to the first in the vocabulary, leaving room for "other"
+        by_count = np.argsort(-counts[candidates], kind="stable")
+        kept = np.sort(candidates[by_count[: max_categories - 1]])
+
+        mapping = np.full(len(vocabulary), len(kept), dtype=codes.dtype)
+        mapping[kept] = np.arange(len(kept))
+        df[column] = np.where(codes >= 0, mapping[np.maximum(codes, 0)], codes)
+        capped_vocabularies[chars] = [vocabulary[i] for i in kept] + ["other"]
+
+    return df, capped_vocabularies
+
+
+def eco_codes_to_sparse(df, eco_vocabularies):
+    """
+    Takes a DataFrame with "eco_{chars}" code columns and the vocabularies they index into.
+
+    Returns a CSR matrix with the one-hot blocks for each truncation side by side, and the matching column names
+    (the same "eco_{chars}_{code}" names the dense one-hot encoding would have produced).
+    """
+    from scipy import sparse
+
+    blocks = []
+    names = []
+    for chars, vocabulary in sorted(eco_vocabularies.items()):
+        codes = df[f"eco_{chars}"].to_numpy()
+        rows = np.flatnonzero(codes >= 0)
+        block = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, codes[rows])),
+            shape=(len(df), len(vocabulary)),
+        )
+        blocks.append(block)
+        names += [f"eco_{chars}_{code}" for code in vocabulary]
+
+    return sparse.hstack(blocks, format="csr"), names
+
+
+def iter_design_matrix(path, columns=None, chunk_size=100_000):
+    """
+    Reads a design matrix as DataFrames of up to chunk_size rows, optionally only the given columns.
+    """
+    file_format = design_matrix_format(path)
+    if file_format == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+        return
+
+    import pyarrow as pa
+
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(path).iter_batches(chunk_size, columns=columns)
+        for batch in batches:
+            yield batch.to_pandas()
+        return
+
+    # Feather files are read in the record batches they were written in, which are one chunk each
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for start in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(start, chunk_size).to_pandas()
+
+
+def _design_matrix_columns(features, target, eco_vocabularies):
+    # The columns to read, and the dense features among them
+    if eco_vocabularies is None:
+        return features + [target], features
+    dense_features = [f for f in features if not f.startswith("eco_")]
+    eco_columns = [f"eco_{chars}" for chars in sorted(eco_vocabularies)]
+    return dense_features + eco_columns + [target], dense_features
+
+
+def _features_and_target(df, features, target, eco_vocabularies):
+    if eco_vocabularies is None:
+        return df[features], df[target], features
+
+    from scipy import sparse
+
+    _, dense_features = _design_matrix_columns(features, target, eco_vocabularies)
+    eco_matrix, eco_features = eco_codes_to_sparse(df, eco_vocabularies)
+    dense_matrix = sparse.csr_matrix(df[dense_features].to_numpy(dtype=np.float32))
+    X = sparse.hstack([dense_matrix, eco_matrix], format="csr")
+
+    return X, df[target], dense_features + eco_features
+
+
+def load_features_and_target(path, features, target, eco_vocabularies=None):
+    """
+    Loads the columns a model needs from a design matrix, returning (X, y, feature_names).
+
+    Without eco_vocabularies, X is a DataFrame with the given features. With them, the design matrix is expected
+    to hold ECO code columns, the eco_* entries of features are replaced by the one-hot columns of the
+    vocabularies, and X is a sparse CSR matrix.
+    """
+    columns, _ = _design_matrix_columns(features, target, eco_vocabularies)
+    df = read_design_matrix(path, columns=columns)
+    return _features_and_target(df, features, target, eco_vocabularies)
+
+
+def iter_features_and_target(
+    path, features, target, eco_vocabularies=None, chunk_size=100_000
+):
+    """
+    Streaming version of load_features_and_target, yielding (X, y, feature_names) for chunks of up to
+    chunk_size rows, so that only one chunk is ever held in memory.
+    """
+    columns, _ = _design_matrix_columns(features, target, eco_vocabularies)
+    for df in iter_design_matrix(path, columns, chunk_size):
+        yield _features_and_target(df, features, target, eco_vocabularies)
+
+
+def load_eco_code_features_and_target(path, features, target, eco_vocabularies):
+    """
+    Loads the given (non-ECO) features followed by one "eco_{chars}" code column per ECO truncation, returning
+    (X, y, feature_names) with X a DataFrame, for models with native categorical support.
+
+    The design matrix may hold either ECO code columns or one-hot columns, which are turned back into codes.
+    """
+    eco_columns = [f"eco_{chars}" for chars in sorted(eco_vocabularies)]
+    if set(eco_columns) <= set(read_design_matrix_header(path)):
+        df = read_design_matrix(path, columns=features + eco_columns + [target])
+    else:
+        one_hot_columns = [
+            f"eco_{chars}_{code}"
+            for chars, vocabulary in sorted(eco_vocabularies.items())
+            for code in vocabulary
+        ]
+        df = read_design_matrix(path, columns=features + one_hot_columns + [target])
+        df = pd.concat(
+            [df[features + [target]], eco_one_hot_to_codes(df, eco_vocabularies)],
+            axis=1,
+        )
+
+    return df[features + eco_columns], df[target], features + eco_columns
@@ -0,0 +1,44 @@
+"""
+Source file for evaluating models on a train/test split.
+
+Besides accuracy, the fit and predict steps are timed, both in wall time and in CPU time (summed over all the
+threads of the process, which matters for estimators that fit in parallel), so that models can be compared on
+accuracy per CPU-second too.
+"""
+
+import time
+
+from sklearn.metrics import accuracy_score, classification_report
+
+
+def fit_and_evaluate(model, X_train, X_test, y_train, y_test):
+    """
+    Fits model on the training split and scores it on the test split, returning a dict of metrics.
+    """
+    start, start_cpu = time.perf_counter(), time.process_time()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    fit_cpu_seconds = time.process_time() - start_cpu
+
+    start = time.perf_counter()
+    y_pred = model.predict(X_test)
+    predict_seconds = time.perf_counter() - start
+
+    return {
+        "classification_report": classification_report(y_test, y_pred),
+        "accuracy": accuracy_score(y_test, y_pred),
+        "fit_seconds": fit_seconds,
+        "fit_cpu_seconds": fit_cpu_seconds,
+        "predict_rows_per_second": len(y_pred) / predict_seconds,
+    }
+
+
+def print_timings(metrics):
+    # Metrics cached before timings were recorded don't have them
+    if "fit_seconds" not in metrics:
+        return
+    print(
+        f"Fit time: {metrics['fit_seconds']:.2f}s "
+        f"({metrics['fit_cpu_seconds']:.2f} CPU-seconds)"
+    )
+    print(f"Predict throughput: {metrics['predict_rows_per_second']:,.0f} rows/s")
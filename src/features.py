@@ -1,93 +1,194 @@
 """
 Source file for all feature extraction code.
+
+The add_* functions add their features to the DataFrame they are given, and return it. The *_columns functions
+and truncated_eco_codes compute the same features without touching their input, returning new NumPy arrays,
+so that a caller can write them straight into a preallocated design matrix (see DesignMatrixBuilder).
 """
 
+import functools
+import json
+import math
+
+import numpy as np
 import pandas as pd
 
+from src.timestamps import (
+    decode_timestamps,
+    game_durations,
+    is_low_precision,
+    time_components,
+)
 
-def add_game_outcome_column(df):
+# extract_features maps a rating r to r / RATING_SCALE - RATING_OFFSET, i.e. 1000 -> -1 and 2000 -> +1
+RATING_SCALE = 500
+RATING_OFFSET = 3
+# Well above the few hundred time controls that occur, and bounded, as the prediction server parses client input
+INCREMENT_CODE_CACHE_SIZE = 1024
+
+
+def game_outcome_columns(winner):
     """
-    Takes a DataFrame with a "winner" column taking values "white", "black", and "draw".
+    Takes a Series of winners taking values "white", "black", and "draw".
 
-    Adds on two columns and returns the result:
+    Returns two arrays:
     - "outcome", which maps white/black to +/- 1, and draws to 0
     - "is_draw", which is 1 if the game is a draw and 0 else
     """
-    df["outcome"] = df["winner"].map({"white": 1, "draw": 0, "black": -1})
-    df["is_draw"] = (df["winner"] == "draw").astype(int)
+    # to_numpy keeps the result numeric when "winner" is categorical (as from load_raw_games)
+    outcome = winner.map({"white": 1, "draw": 0, "black": -1}).to_numpy()
+    is_draw = (winner == "draw").to_numpy().astype(int)
+    return outcome, is_draw
+
+
+def add_game_outcome_column(df):
+    """
+    Takes a DataFrame with a "winner" column, and adds the "outcome" and "is_draw" columns of
+    game_outcome_columns to it.
+    """
+    df["outcome"], df["is_draw"] = game_outcome_columns(df["winner"])
     return df
 
 
+def time_component_columns(created_at):
+    # Extract the relevant components from the unix timestamps, with integer arithmetic (see src/timestamps.py)
+    return time_components(created_at)
+
+
 def add_time_component_columns(df):
-    # Convert timestamps to datetime objects and extract relevant components
-    created_at_datetime = pd.to_datetime(df["created_at"], unit="ms")
-    df["month_of_year"] = created_at_datetime.dt.month
-    df["day_of_week"] = created_at_datetime.dt.dayofweek
-    df["hour_of_day"] = created_at_datetime.dt.hour
+    for column, values in time_component_columns(df["created_at"]).items():
+        df[column] = values
 
     return df
 
 
-def add_approx_time_limit_column(df, max_time_minutes):
-    # Split the increment code into base time and increment time
-    df[["base_minutes", "increment_seconds"]] = df["increment_code"].str.split(
-        "+", expand=True
-    )
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+
+@functools.lru_cache(maxsize=INCREMENT_CODE_CACHE_SIZE)
+def parse_increment_code(increment_code):
+    """
+    Parses an increment code "{minutes}+{seconds}" into (base minutes, increment seconds) as floats.
+
+    Unparseable parts become NaN, as with pd.to_numeric(errors="coerce"). Results are cached, since only a few
+    hundred distinct codes occur across millions of games, in a cache of bounded size, so that arbitrary codes
+    (e.g. sent to the prediction server) can't make it grow without limit.
+    """
+    base, _, increment = str(increment_code).partition("+")
+    return _to_float(base), _to_float(increment)
+
 
-    # Convert base time and increment time to numeric
-    df["base_minutes"] = pd.to_numeric(df["base_minutes"], errors="coerce")
-    df["increment_seconds"] = pd.to_numeric(df["increment_seconds"], errors="coerce")
+def parse_increment_codes(increment_codes):
+    # Parse each distinct code once, then broadcast the results back to the rows
+    # Missing codes get position -1 from factorize, which picks the NaN appended to the lookup table
+    positions, unique_codes = pd.factorize(increment_codes)
+    lookup = np.array(
+        [parse_increment_code(code) for code in unique_codes] + [(math.nan, math.nan)]
+    ).reshape(-1, 2)
+    base_minutes = lookup[positions, 0]
+    increment_seconds = lookup[positions, 1]
+
+    return base_minutes, increment_seconds
+
+
+def approx_time_limit_minutes(increment_code, opening_ply, max_time_minutes):
+    # Split the increment code into base time and increment time
+    base_minutes, increment_seconds = parse_increment_codes(increment_code)
 
     # Calculate the approximate time limit based on base time and increment time
-    df["approx_time_limit_minutes"] = (
-        df["base_minutes"] + df["increment_seconds"] * (40 - df["opening_ply"]) / 60
+    time_limit_minutes = (
+        base_minutes + increment_seconds * (40 - opening_ply.to_numpy()) / 60
     )
 
     # Cap the approximate time limit at 60 minutes
-    df["approx_time_limit_minutes"] = df["approx_time_limit_minutes"].clip(
-        upper=max_time_minutes
-    )
+    return np.minimum(time_limit_minutes, max_time_minutes)
 
-    df.drop(["base_minutes", "increment_seconds"], axis=1, inplace=True)
+
+def add_approx_time_limit_column(df, max_time_minutes):
+    df["approx_time_limit_minutes"] = approx_time_limit_minutes(
+        df["increment_code"], df["opening_ply"], max_time_minutes
+    )
 
     return df
 
 
 def add_game_duration_column(df):
-    # Convert Unix Epoch timestamps to datetime objects
-    df["created_at"] = pd.to_datetime(df["created_at"], unit="ms")
-    df["last_move_at"] = pd.to_datetime(df["last_move_at"], unit="ms")
-
-    # Compute game durations in seconds
-    df["game_duration"] = (df["last_move_at"] - df["created_at"]).dt.total_seconds()
+    # Decode the timestamps without replacing the caller's created_at and last_move_at columns
+    created_at = decode_timestamps(df["created_at"])
+    last_move_at = decode_timestamps(df["last_move_at"])
+
+    # Compute game durations in seconds, and flag those computed from rounded timestamps
+    df["game_duration"] = game_durations(created_at, last_move_at)
+    df["low_precision_duration"] = is_low_precision(created_at) | is_low_precision(
+        last_move_at
+    )
 
     return df
 
 
-def add_truncated_eco_column(df, chars, size_cutoff):
+def fit_eco_vocabulary(eco_counts, chars, size_cutoff):
+    """
+    Takes a Series of game counts indexed by full ECO code, typically accumulated over the whole raw dataset.
+
+    Returns the sorted list of truncated codes with at least size_cutoff games, followed by "other" if any
+    codes fall below the cutoff. This is the set of values add_truncated_eco_column will produce.
+    """
+    truncated_counts = eco_counts.groupby(eco_counts.index.str[:chars]).sum()
+    vocabulary = sorted(truncated_counts[truncated_counts >= size_cutoff].index)
+    if (truncated_counts < size_cutoff).any():
+        vocabulary.append("other")
+
+    return vocabulary
+
+
+def save_eco_vocabulary(vocabularies, path):
+    # Vocabularies are keyed by the number of characters kept from the ECO code
+    with open(path, "w") as f:
+        json.dump({str(chars): codes for chars, codes in vocabularies.items()}, f)
+
+
+def load_eco_vocabulary(path):
+    with open(path) as f:
+        return {int(chars): codes for chars, codes in json.load(f).items()}
+
+
+def add_truncated_eco_column(df, chars, size_cutoff, vocabulary=None):
     column_name = f"eco_{chars}_chars"
 
     # Truncate ECO codes to the specified number of characters
     df[column_name] = df["opening_eco"].str[:chars]
 
-    # Count the number of games by truncated ECO code
-    games_by_eco = df[column_name].value_counts()
+    if vocabulary is None:
+        # Count the number of games by truncated ECO code
+        games_by_eco = df[column_name].value_counts()
 
-    # Filter out codes with counts less than the cutoff
-    codes_to_keep = games_by_eco[games_by_eco >= size_cutoff]
+        # Filter out codes with counts less than the cutoff
+        codes_to_keep = games_by_eco[games_by_eco >= size_cutoff].index
+    else:
+        # Use the codes fitted ahead of time, so the result doesn't depend on which games are in df
+        codes_to_keep = vocabulary
 
     # Replace codes with counts less than the cutoff with 'other'
-    df.loc[~df[column_name].isin(codes_to_keep.index), column_name] = "other"
+    df.loc[~df[column_name].isin(codes_to_keep), column_name] = "other"
 
     return df, column_name
 
 
-def add_one_hot_encoding_for_truncated_eco_code(df, chars, cutoff):
+def add_one_hot_encoding_for_truncated_eco_code(df, chars, cutoff, vocabulary=None):
     # Add truncated codes column
-    df, column_name = add_truncated_eco_column(df, chars, cutoff)
+    df, column_name = add_truncated_eco_column(df, chars, cutoff, vocabulary)
 
     # Convert new column to one-hot encoding
-    one_hot_encoded = pd.get_dummies(df[column_name], prefix=f"eco_{chars}").astype(int)
+    # With a fitted vocabulary every code gets a column, even if it is absent from df
+    values = df[column_name]
+    if vocabulary is not None:
+        values = pd.Categorical(values, categories=vocabulary)
+    one_hot_encoded = pd.get_dummies(values, prefix=f"eco_{chars}").astype(int)
+    one_hot_encoded.index = df.index
 
     # Concatenate the one-hot encoded columns with the original DataFrame
     df = pd.concat([df, one_hot_encoded], axis=1)
@@ -96,3 +197,33 @@ def add_one_hot_encoding_for_truncated_eco_code(df, chars, cutoff):
     df.drop(column_name, axis=1, inplace=True)
 
     return df
+
+
+def truncated_eco_codes(opening_eco, chars, vocabulary):
+    """
+    Returns the position of each game's ECO code, truncated to chars characters, in vocabulary.
+
+    Codes missing from the vocabulary (and missing ECO codes) map to "other", or to -1 if the vocabulary has no
+    "other" entry. Only the distinct ECO codes are truncated and looked up, so this is cheap for categoricals.
+    """
+    positions, unique_codes = pd.factorize(opening_eco)
+    missing = vocabulary.index("other") if "other" in vocabulary else -1
+
+    # The lookup table gets an extra entry for missing ECO codes, which factorize gives position -1
+    truncated = [str(code)[:chars] for code in unique_codes]
+    lookup = pd.Index(vocabulary).get_indexer(pd.Index(truncated, dtype=object))
+    lookup = np.append(lookup, -1)
+    lookup[lookup == -1] = missing
+
+    return lookup[positions]
+
+
+def add_eco_code_column(df, chars, vocabulary):
+    """
+    Compact alternative to add_one_hot_encoding_for_truncated_eco_code.
+
+    Adds a single "eco_{chars}" column holding the truncated_eco_codes of each game.
+    """
+    df[f"eco_{chars}"] = truncated_eco_codes(df["opening_eco"], chars, vocabulary)
+
+    return df
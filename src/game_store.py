@@ -0,0 +1,231 @@
+"""
+Source file for the memory-mapped columnar store of the raw chess games.
+
+Parsing chess_games.csv costs a full pass over the text every time a script starts. convert_raw_games converts it
+once into a directory holding one .npy file per column, which load_raw_games (see src/loading.py) then opens by
+memory-mapping, so that startup no longer depends on the size of the dataset, and only the pages of the columns
+and rows actually used are ever read from disk:
+* numeric and boolean columns are stored with the dtypes declared in RAW_GAMES_DTYPES
+* string columns (ids, player ids, winner, increment code, ECO code and opening name) are dictionary encoded, as
+  int32 codes (-1 for missing values) in "{column}.npy", and their sorted distinct values, as fixed-width UTF-8
+  bytes, in "{column}.dictionary.npy", so that they load as the same categoricals as from the csv
+
+The store remembers the size and modification time of the csv it was converted from, and is ignored once the csv
+changes, until it is converted again. Like the partitioning in extract_features, conversion assumes no quoted
+field contains a line break, which holds for the lichess exports.
+"""
+
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from src.loading import RAW_GAMES_DTYPES, load_raw_games, source_signature
+
+META_FILE = "meta.json"
+CODE_DTYPE = np.int32
+DICTIONARY_DTYPES = ("str", "category")
+
+
+def game_store_path(csv_path):
+    return f"{os.path.splitext(csv_path)[0]}.store"
+
+
+def _count_rows(csv_path):
+    # Rows are lines after the header, with or without a line break at the end of the file
+    lines, last = 0, b"\n"
+    with open(csv_path, "rb") as f:
+        while block := f.read(2**24):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return lines - 1 + (last != b"\n")
+
+
+def _utf8(values):
+    # Fixed-width UTF-8 bytes, whose byte order is the same as the order of the strings
+    return np.char.encode(np.asarray(values, dtype=str), "utf-8")
+
+
+class _Dictionary:
+    # Codes each chunk by its own distinct values, kept as fixed-width bytes rather than Python strings, so that
+    # high cardinality columns (game and player ids) take a few bytes per value, and merges them at the end
+    def __init__(self):
+        self.chunk_values = []
+
+    def encode(self, values):
+        codes, uniques = pd.factorize(values)
+        self.chunk_values.append(_utf8(uniques))
+        return codes.astype(CODE_DTYPE)
+
+    def sorted_values(self):
+        # Returns the distinct values of all chunks in sorted order, and for each chunk the sorted position of
+        # each of its codes
+        if not self.chunk_values:
+            return np.empty(0, dtype="S1"), []
+        values = np.sort(np.concatenate(self.chunk_values))
+        values = values[np.r_[True, values[1:] != values[:-1]]]
+        positions = [
+            np.searchsorted(values, chunk_values).astype(CODE_DTYPE)
+            for chunk_values in self.chunk_values
+        ]
+        return values, positions
+
+
+def convert_raw_games(csv_path, chunk_size=100_000):
+    """
+    Converts the raw games at csv_path into a columnar store next to it (see game_store_path), where
+    open_game_store finds it, reading the csv one chunk at a time, and returns the opened GameStore.
+    """
+    store_path = game_store_path(csv_path)
+    os.makedirs(store_path, exist_ok=True)
+    # The metadata is written last, so a store is only ever opened once fully converted
+    meta_path = os.path.join(store_path, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    signature = source_signature(csv_path)
+    n_rows = _count_rows(csv_path)
+
+    columns = {}
+    for column, dtype in RAW_GAMES_DTYPES.items():
+        encoding = "dictionary" if dtype in DICTIONARY_DTYPES else "plain"
+        columns[column] = {
+            "encoding": encoding,
+            "dtype": np.dtype(CODE_DTYPE if encoding == "dictionary" else dtype).str,
+        }
+
+    arrays = {
+        column: np.lib.format.open_memmap(
+            os.path.join(store_path, f"{column}.npy"),
+            mode="w+",
+            dtype=np.dtype(spec["dtype"]),
+            shape=(n_rows,),
+        )
+        for column, spec in columns.items()
+    }
+    dictionaries = {
+        column: _Dictionary()
+        for column, spec in columns.items()
+        if spec["encoding"] == "dictionary"
+    }
+
+    chunk_bounds = []
+    start = 0
+    for chunk in load_raw_games(csv_path, use_store=False, chunksize=chunk_size):
+        end = start + len(chunk)
+        if end > n_rows:
+            raise ValueError(f"{csv_path} has rows spanning several lines")
+        for column, array in arrays.items():
+            if column in dictionaries:
+                array[start:end] = dictionaries[column].encode(chunk[column])
+            else:
+                array[start:end] = chunk[column].to_numpy()
+        chunk_bounds.append((start, end))
+        start = end
+    if start != n_rows:
+        raise ValueError(f"{csv_path} has rows spanning several lines")
+
+    # Codes were assigned per chunk, so are renumbered in the sorted order of the values over all chunks
+    # Sorted dictionaries give the same categories as read_csv infers (on files it parses in a single block),
+    # whatever the order of the rows
+    for column, dictionary in dictionaries.items():
+        values, positions = dictionary.sorted_values()
+        np.save(os.path.join(store_path, f"{column}.dictionary.npy"), values)
+        codes = arrays[column]
+        for (start, end), chunk_positions in zip(chunk_bounds, positions):
+            chunk = codes[start:end]
+            chunk[chunk >= 0] = chunk_positions[chunk[chunk >= 0]]
+    for array in arrays.values():
+        array.flush()
+
+    with open(meta_path, "w") as f:
+        json.dump(
+            {"n_rows": n_rows, "columns": columns, "source": signature}, f, indent=2
+        )
+
+    return GameStore(store_path)
+
+
+def open_game_store(csv_path):
+    """
+    Returns the GameStore converted from csv_path, or None if there is none, or it is out of date.
+    """
+    store_path = game_store_path(csv_path)
+    if not os.path.exists(os.path.join(store_path, META_FILE)):
+        return None
+
+    store = GameStore(store_path)
+    if store.source != source_signature(csv_path):
+        warnings.warn(
+            f"{store_path} is out of date, reading {csv_path} instead "
+            "(run scripts/convert_raw_games.py to update it)"
+        )
+        return None
+    return store
+
+
+class GameStore:
+    """
+    A memory-mapped columnar store of raw games, written by convert_raw_games.
+
+    column returns the stored array of a column as a read-only memory map (the codes, for dictionary encoded
+    columns), without copying anything. read and iter_chunks return DataFrames of the columns and rows asked
+    for, with dictionary encoded columns as categoricals, and numeric columns still backed by the memory maps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.n_rows = meta["n_rows"]
+        self.source = meta["source"]
+        self._columns = meta["columns"]
+        self._categories = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def is_dictionary_encoded(self, column):
+        return self._columns[column]["encoding"] == "dictionary"
+
+    def _load(self, name):
+        # Empty files can't be memory-mapped
+        mmap_mode = "r" if self.n_rows else None
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    def column(self, column):
+        return self._load(column)
+
+    def dictionary(self, column):
+        return self._load(f"{column}.dictionary")
+
+    def categories(self, column):
+        # The decoded distinct values of a dictionary encoded column, in code order
+        if column not in self._categories:
+            values = np.char.decode(np.asarray(self.dictionary(column)), "utf-8")
+            self._categories[column] = pd.Index(values, dtype="str")
+        return self._categories[column]
+
+    def read(self, columns=None, rows=slice(None)):
+        """
+        Returns a DataFrame of the given columns (by default all) for rows, a slice or an array of row numbers.
+        """
+        data = {}
+        for column in self.columns if columns is None else columns:
+            values = self.column(column)[rows]
+            if self.is_dictionary_encoded(column):
+                dtype = pd.CategoricalDtype(self.categories(column))
+                values = pd.Categorical.from_codes(values, dtype=dtype)
+            data[column] = values
+
+        index = pd.RangeIndex(self.n_rows)[rows]
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def iter_chunks(self, columns=None, chunk_size=100_000):
+        for start in range(0, self.n_rows, chunk_size):
+            yield self.read(columns, slice(start, start + chunk_size))
@@ -0,0 +1,82 @@
+"""
+Source file for loading the raw chess games.
+
+Declares the schema of chess_games.csv (see README_prompt.md) up front, instead of letting pandas infer it:
+* low-cardinality strings (winner, increment code, ECO code and opening name) are loaded as categoricals
+* ratings and opening moves are loaded as sized ints
+* "rated" is parsed straight from its TRUE/FALSE text into bools
+
+Callers should pass the columns they use, so that the others are never parsed. The optional pyarrow engine
+parses with multiple threads, but does not support reading in chunks.
+
+Once the csv has been converted into a columnar store (see src/game_store.py), the same calls memory-map the
+store instead of parsing the csv. String columns then come back as categoricals, ids included.
+"""
+
+import os
+
+import pandas as pd
+
+RAW_GAMES_PATH = "./data/chess_games.csv"
+
+RAW_GAMES_DTYPES = {
+    "id": "str",
+    "rated": "bool",
+    "created_at": "float64",
+    "last_move_at": "float64",
+    "winner": "category",
+    "increment_code": "category",
+    "white_id": "str",
+    "white_rating": "int16",
+    "black_id": "str",
+    "black_rating": "int16",
+    "opening_eco": "category",
+    "opening_name": "category",
+    "opening_ply": "int8",
+}
+
+
+def source_signature(path):
+    # Identifies a version of a raw games file, for whatever is derived from it to tell when it is out of date
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_raw_games(
+    path=RAW_GAMES_PATH, columns=None, engine=None, use_store=True, **read_csv_kwargs
+):
+    """
+    Reads raw games with the declared schema, optionally only the given columns.
+
+    Other keyword arguments go to pd.read_csv, e.g. chunksize to iterate over chunks, or names and header to
+    read a headerless slice of the file. Reading whole files (in chunks or not) uses the columnar store converted
+    from path if there is an up to date one, unless use_store is False.
+    """
+    if use_store and isinstance(path, str) and set(read_csv_kwargs) <= {"chunksize"}:
+        from src.game_store import open_game_store
+
+        store = open_game_store(path)
+        if store is not None:
+            # Columns come in file order, as from pd.read_csv
+            columns = [c for c in store.columns if columns is None or c in columns]
+            chunksize = read_csv_kwargs.get("chunksize")
+            if chunksize is None:
+                return store.read(columns)
+            return store.iter_chunks(columns, chunksize)
+
+    names = read_csv_kwargs.get("names") or RAW_GAMES_DTYPES
+    dtype = {
+        column: RAW_GAMES_DTYPES[column]
+        for column in (columns or names)
+        if column in RAW_GAMES_DTYPES
+    }
+
+    return pd.read_csv(
+        path,
+        usecols=columns,
+        dtype=dtype,
+        engine=engine,
+        true_values=["TRUE", "True", "true"],
+        false_values=["FALSE", "False", "false"],
+        **read_csv_kwargs,
+    )
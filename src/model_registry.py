@@ -0,0 +1,122 @@
+"""
+Source file for persisting fitted models.
+
+A saved model is a joblib file holding the fitted estimator together with the names of the features it was
+trained on, in training order, and the ECO vocabularies its design matrix was encoded with, so that whoever
+loads it can build matching inputs, even after the shared vocabulary has been refitted.
+
+Fitted models are also cached under MODELS_DIR/cache, keyed by a fingerprint of everything that determines the
+fit: the training data, the feature list, the train/test split and the estimator with its hyperparameters. The
+cached entry stores the evaluation metrics too, so rerunning a model script on unchanged inputs skips both the
+training and the evaluation. Results of fits whose models aren't worth keeping, such as the folds of a
+hyperparameter search, are cached as JSON under MODELS_DIR/results, keyed the same way.
+"""
+
+import hashlib
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+MODELS_DIR = "./models/artifacts"
+CACHE_DIR = os.path.join(MODELS_DIR, "cache")
+RESULTS_DIR = os.path.join(MODELS_DIR, "results")
+
+
+def model_path(name):
+    return os.path.join(MODELS_DIR, f"{name}.joblib")
+
+
+def save_model(model, features, path, eco_vocabularies=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    saved = {
+        "model": model,
+        "features": list(features),
+        "eco_vocabularies": eco_vocabularies,
+    }
+    joblib.dump(saved, path)
+
+
+def load_model(path):
+    # Returns (model, features, eco_vocabularies), with None vocabularies for models saved without them
+    saved = joblib.load(path)
+    return saved["model"], saved["features"], saved.get("eco_vocabularies")
+
+
+def _update_with_data(h, data):
+    # Hash the values, whether they are held in pandas, NumPy or a scipy.sparse matrix
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    elif hasattr(data, "tocsr"):
+        data = data.tocsr()
+        for array in (data.data, data.indices, data.indptr):
+            h.update(np.ascontiguousarray(array).tobytes())
+    else:
+        h.update(np.ascontiguousarray(data).tobytes())
+
+
+def data_fingerprint(X, y):
+    # Hashing the data is the expensive part, so callers fingerprinting many fits on the same data do it once
+    h = hashlib.sha256()
+    _update_with_data(h, X)
+    _update_with_data(h, y)
+    return h.hexdigest()
+
+
+def model_fingerprint(model, X, y, features, data_digest=None, **split):
+    """
+    Takes an unfitted estimator, the full X and y it will be trained and tested on, the feature names, and the
+    keyword arguments given to train_test_split (e.g. test_size=0.2, random_state=13), or any other description
+    of how the data is split.
+
+    Returns a hex digest that changes whenever any of them, or the installed scikit-learn version, changes.
+    If data_digest (from data_fingerprint) is given, X and y aren't hashed again and may be None.
+    """
+    h = hashlib.sha256()
+    key = {
+        "estimator": type(model).__name__,
+        "params": model.get_params(),
+        "features": list(features),
+        "split": split,
+        "sklearn": sklearn.__version__,
+    }
+    h.update(json.dumps(key, sort_keys=True, default=str).encode())
+    h.update((data_digest or data_fingerprint(X, y)).encode())
+
+    return h.hexdigest()
+
+
+def load_cached_model(fingerprint):
+    # Returns (model, features, metrics), or None on a cache miss
+    path = os.path.join(CACHE_DIR, f"{fingerprint}.joblib")
+    if not os.path.exists(path):
+        return None
+    cached = joblib.load(path)
+    return cached["model"], cached["features"], cached["metrics"]
+
+
+def save_cached_model(fingerprint, model, features, metrics):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cached = {"model": model, "features": list(features), "metrics": metrics}
+    joblib.dump(cached, os.path.join(CACHE_DIR, f"{fingerprint}.joblib"))
+
+
+def load_cached_result(fingerprint):
+    # Evaluation results without the fitted model, e.g. for one fold of a cross-validation, or None on a miss
+    path = os.path.join(RESULTS_DIR, f"{fingerprint}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cached_result(fingerprint, result):
+    # Written next to the final file and swapped in, so an interrupted run never leaves a partial result
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{fingerprint}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,121 @@
+"""
+Source file for fitting linear models on design matrices too large to load.
+
+fit_online_logistic_regression streams the design matrix in chunks (see iter_features_and_target) and fits a
+logistic regression by stochastic gradient descent, so memory use depends on the chunk size rather than on the
+number of games:
+* a first pass fits the feature scaling, since SGD converges poorly on features of very different scales
+* each epoch then passes over the training rows once more, shuffling the rows of each chunk and updating the
+  model with one partial_fit per batch_size of them
+* a final pass predicts the test rows
+
+Rows are assigned to the test set at random with probability test_size, by a generator reseeded on every pass,
+so each pass sees the same split without it ever being held in memory.
+"""
+
+import time
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import accuracy_score, classification_report
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from src.design_matrix import iter_features_and_target
+
+OUTCOME_CLASSES = np.array([-1, 0, 1])
+
+
+def _iter_split_chunks(
+    path, features, target, eco_vocabularies, chunk_size, test_size, random_state
+):
+    # Yields (X, y, is_test, feature_names) per chunk, with the same is_test on every pass
+    rng = np.random.default_rng(random_state)
+    chunks = iter_features_and_target(
+        path, features, target, eco_vocabularies, chunk_size
+    )
+    for X, y, feature_names in chunks:
+        yield X, y.to_numpy(), rng.random(len(y)) < test_size, feature_names
+
+
+def fit_online_logistic_regression(
+    path,
+    features,
+    target,
+    eco_vocabularies=None,
+    chunk_size=100_000,
+    batch_size=5_000,
+    epochs=10,
+    test_size=0.2,
+    random_state=13,
+):
+    """
+    Fits a scaled SGD logistic regression on the design matrix at path, one chunk at a time.
+
+    Returns (model, feature_names, metrics), where model is a fitted scaler + classifier pipeline and metrics
+    has the same entries as fit_and_evaluate.
+    """
+
+    def split_chunks():
+        return _iter_split_chunks(
+            path,
+            features,
+            target,
+            eco_vocabularies,
+            chunk_size,
+            test_size,
+            random_state,
+        )
+
+    # Sparse (one-hot ECO) inputs can only be scaled, not centred, without densifying them
+    scaler = StandardScaler(with_mean=eco_vocabularies is None)
+
+    start, start_cpu = time.perf_counter(), time.process_time()
+    for X, y, is_test, feature_names in split_chunks():
+        if (~is_test).any():
+            scaler.partial_fit(X[~is_test])
+
+    # Averaging the SGD iterates smooths out the noise of single steps, which otherwise costs several points
+    # of accuracy on this data. It only starts after the first epoch (once as many rows as the training set
+    # have been seen), as the iterates before then are still far from the optimum: averaged from the start,
+    # the accuracy on synthetic games landed anywhere between 0.64 and 0.75
+    n_train_rows = int(np.max(scaler.n_samples_seen_))
+    classifier = SGDClassifier(loss="log_loss", average=n_train_rows, random_state=42)
+
+    # Seeded apart from the split, so the shuffles don't change which rows are held out
+    shuffle_rng = np.random.default_rng(random_state + 1)
+    for _ in range(epochs):
+        for X, y, is_test, _ in split_chunks():
+            if not (~is_test).any():
+                continue
+            # Scaled to an array (or CSR matrix), so the shuffled rows can be taken by position
+            X_train, y_train = scaler.transform(X[~is_test]), y[~is_test]
+            order = shuffle_rng.permutation(len(y_train))
+            for batch_start in range(0, len(order), batch_size):
+                rows = order[batch_start : batch_start + batch_size]
+                classifier.partial_fit(
+                    X_train[rows], y_train[rows], classes=OUTCOME_CLASSES
+                )
+    fit_seconds = time.perf_counter() - start
+    fit_cpu_seconds = time.process_time() - start_cpu
+
+    # Only the test labels and predictions are kept, a small int per test game
+    start = time.perf_counter()
+    y_test, y_pred = [], []
+    for X, y, is_test, _ in split_chunks():
+        if is_test.any():
+            y_test.append(y[is_test].astype(np.int8))
+            y_pred.append(
+                classifier.predict(scaler.transform(X[is_test])).astype(np.int8)
+            )
+    predict_seconds = time.perf_counter() - start
+    y_test, y_pred = np.concatenate(y_test), np.concatenate(y_pred)
+
+    metrics = {
+        "classification_report": classification_report(y_test, y_pred),
+        "accuracy": accuracy_score(y_test, y_pred),
+        "fit_seconds": fit_seconds,
+        "fit_cpu_seconds": fit_cpu_seconds,
+        "predict_rows_per_second": len(y_pred) / predict_seconds,
+    }
+    return make_pipeline(scaler, classifier), feature_names, metrics
@@ -0,0 +1,134 @@
+"""
+Source file for featurizing individual games outside of pandas.
+
+The functions in src/features.py work on whole DataFrames, which costs milliseconds of overhead even for a
+single game. FeaturePipeline holds everything fitted ahead of time (the ECO vocabularies, the rating
+normalization and the time limit cap) and turns raw game records, as dicts using the chess_games.csv schema,
+into NumPy rows in the column order the models are trained on (that of design_matrix_columns), using plain
+Python arithmetic and dict lookups.
+"""
+
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.design_matrix import TIME_COMPONENT_COLUMNS, design_matrix_columns
+from src.features import (
+    RATING_OFFSET,
+    RATING_SCALE,
+    fit_eco_vocabulary,
+    load_eco_vocabulary,
+    parse_increment_code,
+)
+
+TARGET_COLUMNS = ["outcome", "is_draw"]
+
+
+def _parse_bool(value):
+    # Raw records may hold real bools, or the "TRUE"/"FALSE" strings of the csv
+    if isinstance(value, str):
+        return value.strip().upper() == "TRUE"
+    return bool(value)
+
+
+class FeaturePipeline:
+    """
+    Featurizes raw games into the design matrix columns used by the models.
+
+    Build one with FeaturePipeline.load (from a saved ECO vocabulary) or FeaturePipeline.fit (from a DataFrame of
+    raw games), then call transform_record for one game or transform_records for a micro-batch.
+    """
+
+    def __init__(self, eco_vocabularies, max_time_limit_minutes):
+        self.eco_vocabularies = eco_vocabularies
+        self.max_time_limit_minutes = max_time_limit_minutes
+
+        # The feature columns of the one-hot design matrix, in the order extract_features writes them
+        self.feature_names = [
+            name
+            for name, _ in design_matrix_columns(eco_vocabularies)
+            if name not in TARGET_COLUMNS
+        ]
+        positions = {name: i for i, name in enumerate(self.feature_names)}
+        self._rated = positions["rated"]
+        self._white_rating = positions["white_rating"]
+        self._black_rating = positions["black_rating"]
+        self._rating_advantage = positions["white_rating_advantage"]
+        self._time_limit = positions["approx_time_limit_hours"]
+        self._time_components = [positions[c] for c in TIME_COMPONENT_COLUMNS]
+
+        # For each truncation, map codes to their column, with unknown codes going to "other" if it exists
+        self._eco_columns = []
+        for chars, vocabulary in sorted(eco_vocabularies.items()):
+            columns = {code: positions[f"eco_{chars}_{code}"] for code in vocabulary}
+            self._eco_columns.append((chars, columns, columns.get("other")))
+
+    @classmethod
+    def load(cls, vocabulary_path, max_time_limit_minutes):
+        return cls(load_eco_vocabulary(vocabulary_path), max_time_limit_minutes)
+
+    @classmethod
+    def fit(cls, df, size_cutoff, max_time_limit_minutes, chars=(1, 2, 3)):
+        eco_counts = df["opening_eco"].value_counts()
+        eco_vocabularies = {
+            c: fit_eco_vocabulary(eco_counts, c, size_cutoff) for c in chars
+        }
+        return cls(eco_vocabularies, max_time_limit_minutes)
+
+    def _fill_row(self, record, row):
+        # Ratings, normalized the same way as in extract_features
+        white_rating = record["white_rating"] / RATING_SCALE - RATING_OFFSET
+        black_rating = record["black_rating"] / RATING_SCALE - RATING_OFFSET
+        row[self._rated] = _parse_bool(record["rated"])
+        row[self._white_rating] = white_rating
+        row[self._black_rating] = black_rating
+        row[self._rating_advantage] = white_rating - black_rating
+
+        # Approximate time limit, as in add_approx_time_limit_column, converted to hours
+        # The batch path would get a NaN feature, which no model accepts, so bad codes are rejected here
+        base, increment = parse_increment_code(record["increment_code"])
+        if math.isnan(base) or math.isnan(increment):
+            raise ValueError(
+                f"increment_code {record['increment_code']!r} is not of the form "
+                '"{minutes}+{seconds}"'
+            )
+        time_limit = base + increment * (40 - int(record["opening_ply"])) / 60
+        row[self._time_limit] = min(time_limit, self.max_time_limit_minutes) / 60
+
+        # One-hot ECO truncations, with missing codes going to "other" as in truncated_eco_codes
+        opening_eco = record.get("opening_eco")
+        for chars, columns, other_column in self._eco_columns:
+            if isinstance(opening_eco, str):
+                column = columns.get(opening_eco[:chars], other_column)
+            else:
+                column = other_column
+            if column is not None:
+                row[column] = 1
+
+        # Time of play, in UTC as with pd.to_datetime(unit="ms")
+        created_at = time.gmtime(int(float(record["created_at"])) // 1000)
+        month, day, hour = self._time_components
+        row[month] = created_at.tm_mon
+        row[day] = created_at.tm_wday
+        row[hour] = created_at.tm_hour
+
+    def transform_record(self, record):
+        row = np.zeros(len(self.feature_names))
+        self._fill_row(record, row)
+        return row
+
+    def transform_records(self, records):
+        rows = np.zeros((len(records), len(self.feature_names)))
+        for record, row in zip(records, rows):
+            self._fill_row(record, row)
+        return rows
+
+    def transform_frame(self, df):
+        # Convenience for raw games already held in a DataFrame
+        return pd.DataFrame(
+            self.transform_records(df.to_dict("records")),
+            columns=self.feature_names,
+            index=df.index,
+        )
@@ -0,0 +1,171 @@
+"""
+Source file for features of each player's history before a game.
+
+For both players of every game, we compute from their earlier games:
+* the number of games they played before
+* their average score (1 for a win, 0.5 for a draw, 0 for a loss) over their last PLAYER_WINDOW games
+* how their (normalized) rating moved over those games, from the first to the last of them
+
+Recomputing this from a player's whole history for every game would be quadratic, so PlayerIndex first groups
+the games of each player, sorted by created_at, with a single sort over all (player, game) appearances. Every
+statistic is then a difference of cumulative sums along each player's games, so the whole computation is
+O(n log n) in the number of games.
+
+Only games created strictly before a game count towards its features, so no game ever sees its own result or the
+result of a later game. Games of the same player created at the same time (the raw timestamps are coarse) are
+treated as not having happened yet for each other, which errs on the side of leaving information out.
+"""
+
+import numpy as np
+import pandas as pd
+
+from src.features import RATING_SCALE
+
+PLAYER_WINDOW = 20
+PLAYER_HISTORY_SOURCE_COLUMNS = [
+    "created_at",
+    "white_id",
+    "black_id",
+    "winner",
+    "white_rating",
+    "black_rating",
+]
+PLAYER_HISTORY_STATISTICS = {
+    "games_played": "int32",
+    "recent_score": "float64",
+    "rating_trend": "float64",
+}
+PLAYER_HISTORY_COLUMNS = [
+    f"{side}_{statistic}"
+    for side in ("white", "black")
+    for statistic in PLAYER_HISTORY_STATISTICS
+]
+
+# The recent score of a player without any earlier games
+NO_HISTORY_SCORE = 0.5
+
+
+class PlayerIndex:
+    """
+    The games of every player, sorted by created_at.
+
+    Stored as flat arrays of (player, game) appearances, sorted by player and then time: the appearances of the
+    i-th player are at positions indptr[i]:indptr[i + 1], and each has the offset of its game in the input
+    (games), the side the player had (sides, 0 for white and 1 for black) and the game's created_at (times).
+    """
+
+    def __init__(self, players, indptr, games, sides, times):
+        self.players = players
+        self.indptr = indptr
+        self.games = games
+        self.sides = sides
+        self.times = times
+
+    @classmethod
+    def build(cls, white_id, black_id, created_at):
+        n_games = len(created_at)
+        codes, players = pd.factorize(
+            np.concatenate([np.asarray(white_id), np.asarray(black_id)])
+        )
+        games = np.tile(np.arange(n_games), 2)
+        sides = np.repeat(np.array([0, 1], dtype=np.int8), n_games)
+        times = np.tile(np.asarray(created_at, dtype=np.float64), 2)
+
+        # One sort by player, and by time within each player (ties in input order)
+        order = np.lexsort((games, times, codes))
+        indptr = np.zeros(len(players) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(players)), out=indptr[1:])
+
+        return cls(pd.Index(players), indptr, games[order], sides[order], times[order])
+
+    def __len__(self):
+        return len(self.players)
+
+    def player_games(self, player_id):
+        # Offsets of the player's games, in the order they were created
+        i = self.players.get_loc(player_id)
+        return self.games[self.indptr[i] : self.indptr[i + 1]]
+
+
+def _exclusive_cumsum(values):
+    # cumsum[i] is the sum of values[:i]
+    cumsum = np.zeros(len(values) + 1)
+    np.cumsum(values, out=cumsum[1:])
+    return cumsum
+
+
+def player_history_columns(
+    index, winner, white_rating, black_rating, window=PLAYER_WINDOW
+):
+    """
+    Computes the player history features of every game in index, returning a dict of arrays aligned with the
+    games it was built from, keyed by PLAYER_HISTORY_COLUMNS.
+    """
+    games, sides = index.games, index.sides
+    n_appearances = len(games)
+    n_games = n_appearances // 2
+    positions = np.arange(n_appearances)
+
+    # The score and (normalized) rating of the player in each appearance
+    winner = np.asarray(winner, dtype=object)[games]
+    white_score = np.where(winner == "white", 1.0, np.where(winner == "draw", 0.5, 0.0))
+    score = np.where(sides == 0, white_score, 1.0 - white_score)
+    rating = (
+        np.where(
+            sides == 0,
+            np.asarray(white_rating)[games],
+            np.asarray(black_rating)[games],
+        )
+        / RATING_SCALE
+    )
+
+    # Where each player's appearances start, and where the ones at the same time as each appearance start
+    player_start = np.repeat(index.indptr[:-1], np.diff(index.indptr))
+    is_new_time = np.ones(n_appearances, dtype=bool)
+    is_new_time[1:] = (player_start[1:] != player_start[:-1]) | (
+        index.times[1:] != index.times[:-1]
+    )
+    history_end = np.maximum.accumulate(np.where(is_new_time, positions, 0))
+
+    # The earlier games are at history_end - games_played:history_end, and the recent ones at the end of those
+    games_played = history_end - player_start
+    window_start = np.maximum(player_start, history_end - window)
+    recent_games = history_end - window_start
+
+    score_cumsum = _exclusive_cumsum(score)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        recent_score = (
+            score_cumsum[history_end] - score_cumsum[window_start]
+        ) / recent_games
+    recent_score[recent_games == 0] = NO_HISTORY_SCORE
+
+    last = np.maximum(history_end - 1, 0)
+    rating_trend = np.where(recent_games >= 2, rating[last] - rating[window_start], 0.0)
+
+    # Scatter the appearances back to the games, per side
+    statistics = {
+        "games_played": games_played,
+        "recent_score": recent_score,
+        "rating_trend": rating_trend,
+    }
+    columns = {}
+    for side_code, side in enumerate(("white", "black")):
+        is_side = sides == side_code
+        for statistic, dtype in PLAYER_HISTORY_STATISTICS.items():
+            column = np.empty(n_games, dtype=dtype)
+            column[games[is_side]] = statistics[statistic][is_side]
+            columns[f"{side}_{statistic}"] = column
+
+    return columns
+
+
+def player_history_features(games, window=PLAYER_WINDOW):
+    """
+    Takes a DataFrame with PLAYER_HISTORY_SOURCE_COLUMNS (in any order of time), and returns a DataFrame of the
+    player history features of its games, with the same index.
+    """
+    index = PlayerIndex.build(games["white_id"], games["black_id"], games["created_at"])
+    columns = player_history_columns(
+        index, games["winner"], games["white_rating"], games["black_rating"], window
+    )
+    return pd.DataFrame(columns, index=games.index)
@@ -0,0 +1,190 @@
+"""
+Source file for timing the stages of a pipeline.
+
+A StageProfiler records, for every named stage, how often it ran, its total wall time, the rows going in and
+out, and the change in resident memory across it. Stages are marked with a context manager, and for stages that
+run once per chunk the numbers are summed over the chunks:
+
+    profiler = StageProfiler()
+    with profiler.stage("dedup", df) as stage:
+        df = drop_duplicate_games(df)
+        stage.rows_out = len(df)
+    profiler.print_report()
+
+Used as a context manager itself, the profiler can also run cProfile and tracemalloc over its whole lifetime and
+dump their results on exit, for use with pstats/snakeviz and tracemalloc.Snapshot.load. While tracemalloc is
+tracing, each stage additionally records its peak of Python allocations.
+
+Profiling is off by default: code taking a profiler=None argument uses NULL_PROFILER, whose stages do nothing.
+"""
+
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+REPORT_FIELDS = [
+    "stage",
+    "calls",
+    "wall_seconds",
+    "rows_in",
+    "rows_out",
+    "rss_delta_mb",
+    "traced_peak_mb",
+]
+
+
+def rss_mb():
+    """
+    Returns the resident set size of this process in MB, or None where /proc isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return None
+
+
+class Stage:
+    """
+    Measurements of one run of a stage. rows_out defaults to rows_in, and should be set by stages that filter.
+    """
+
+    def __init__(self, rows_in):
+        self.rows_in = rows_in
+        self.rows_out = rows_in
+
+
+class StageProfiler:
+    """
+    Aggregates per-stage wall time, row counts and memory deltas, in the order stages first ran.
+
+    cprofile_path and tracemalloc_path, if given, are where cProfile stats and a tracemalloc snapshot are dumped
+    when the profiler is used as a context manager.
+    """
+
+    def __init__(self, cprofile_path=None, tracemalloc_path=None, enabled=True):
+        self.enabled = enabled
+        self.cprofile_path = cprofile_path
+        self.tracemalloc_path = tracemalloc_path
+        self.stages = {}
+        self._profile = None
+
+    def __enter__(self):
+        if self.cprofile_path:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.tracemalloc_path:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile_path)
+            self._profile = None
+        if self.tracemalloc_path:
+            tracemalloc.take_snapshot().dump(self.tracemalloc_path)
+            tracemalloc.stop()
+
+    def _add(self, name, calls, seconds, rows_in, rows_out, rss_delta, traced_peak):
+        totals = self.stages.setdefault(
+            name,
+            {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "rows_in": 0,
+                "rows_out": 0,
+                "rss_delta_mb": None,
+                "traced_peak_mb": None,
+            },
+        )
+        totals["calls"] += calls
+        totals["wall_seconds"] += seconds
+        totals["rows_in"] += rows_in or 0
+        totals["rows_out"] += rows_out or 0
+        if rss_delta is not None:
+            totals["rss_delta_mb"] = (totals["rss_delta_mb"] or 0) + rss_delta
+        if traced_peak is not None:
+            totals["traced_peak_mb"] = max(totals["traced_peak_mb"] or 0, traced_peak)
+
+    @contextmanager
+    def stage(self, name, df=None):
+        """
+        Times the body as one run of the named stage, taking rows_in from df (any sized object) if given.
+        """
+        stage = Stage(len(df) if df is not None else None)
+        if not self.enabled:
+            yield stage
+            return
+
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        yield stage
+        seconds = time.perf_counter() - start
+        rss_after = rss_mb()
+
+        rss_delta = rss_after - rss_before if rss_before is not None else None
+        traced_peak = tracemalloc.get_traced_memory()[1] / 2**20 if tracing else None
+        self._add(
+            name, 1, seconds, stage.rows_in, stage.rows_out, rss_delta, traced_peak
+        )
+
+    def iterate(self, name, iterable):
+        """
+        Yields from iterable, timing each step as a run of the named stage, e.g. for reading chunks.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as stage:
+                item = next(iterator, StopIteration)
+                stage.rows_out = len(item) if item is not StopIteration else 0
+            if item is StopIteration:
+                return
+            yield item
+
+    def merge(self, stages):
+        """
+        Adds the stage totals recorded by another profiler, e.g. one running in a worker process.
+        """
+        for name, other in stages.items():
+            self._add(
+                name,
+                other["calls"],
+                other["wall_seconds"],
+                other["rows_in"],
+                other["rows_out"],
+                other["rss_delta_mb"],
+                other["traced_peak_mb"],
+            )
+
+    def report(self):
+        return [dict(stage=name, **totals) for name, totals in self.stages.items()]
+
+    def save_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def print_report(self):
+        def cell(value):
+            if value is None:
+                return "-"
+            return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+        # The stage name is left-aligned, and the measurements right-aligned
+        print(
+            f"{REPORT_FIELDS[0]:20s}" + "".join(f"{f:>16s}" for f in REPORT_FIELDS[1:])
+        )
+        for row in self.report():
+            print(
+                f"{row['stage']:20s}"
+                + "".join(f"{cell(row[f]):>16s}" for f in REPORT_FIELDS[1:])
+            )
+
+
+NULL_PROFILER = StageProfiler(enabled=False)
@@ -0,0 +1,268 @@
+"""
+Source file for lazy queries over the raw games.
+
+A GameQuery describes which games and columns an analysis needs, without loading anything: filters (on whether
+the game is rated, its winner, the prefix of its ECO code, and the players' ratings), derived columns, and a
+projection. Nothing is read until the query is run, by collect, count, value_counts, group_by(...).agg or
+histogram, which stream over the games in chunks and so never hold more than a chunk of the raw games, plus the
+(projected, filtered) result, in memory.
+
+Queries run over the columnar store of the raw games if there is an up to date one (see src/game_store.py), and
+over the csv in chunks otherwise. Either way, only the columns the query uses are read, and games are
+deduplicated by id, keeping the first, as drop_duplicate_games does. Over the store, filters are evaluated on
+their own columns first, and the other columns are then only read for the games that passed them.
+
+    draws = GameQuery().where_rated(True).where_winner("draw").select("white_rating", "black_rating")
+    by_winner = GameQuery().group_by("winner").agg(games="count", white_rating=("white_rating", "mean"))
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+from src.dedup import GameIdIndex, drop_duplicate_games
+from src.game_store import open_game_store
+from src.loading import RAW_GAMES_PATH, load_raw_games
+
+CHUNK_SIZE = 100_000
+RATING_SIDES = {
+    "white": ["white_rating"],
+    "black": ["black_rating"],
+    "both": ["white_rating", "black_rating"],
+}
+# How partial aggregates of chunks combine into the aggregate over all games
+COMBINE = {"count": "sum", "sum": "sum", "min": "min", "max": "max"}
+
+
+def _category_mask(values, accept):
+    # Evaluates accept once per category of a categorical column, rather than once per game
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories.to_series()
+        # Missing values have code -1, which picks the False appended at the end
+        accepted = np.append(accept(categories).to_numpy(), False)
+        return accepted[values.cat.codes.to_numpy()]
+    return accept(values).to_numpy()
+
+
+class GameQuery:
+    """
+    A lazily evaluated query over the raw games at path. Every method returns a new query, leaving this one as is.
+    """
+
+    def __init__(self, path=RAW_GAMES_PATH, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._filters = ()
+        self._derived = {}
+        self._columns = None
+
+    def _with(self, **changes):
+        query = copy.copy(self)
+        query.__dict__.update(changes)
+        return query
+
+    def where(self, columns, predicate):
+        """
+        Keeps the games for which predicate, given a chunk with (at least) columns, returns True.
+        """
+        return self._with(_filters=self._filters + ((list(columns), predicate),))
+
+    def where_rated(self, rated=True):
+        return self.where(["rated"], lambda df: df["rated"].to_numpy() == rated)
+
+    def where_winner(self, *winners):
+        return self.where(
+            ["winner"],
+            lambda df: _category_mask(df["winner"], lambda v: v.isin(winners)),
+        )
+
+    def where_eco_prefix(self, *prefixes):
+        return self.where(
+            ["opening_eco"],
+            lambda df: _category_mask(
+                df["opening_eco"], lambda v: v.str.startswith(prefixes)
+            ),
+        )
+
+    def where_rating(self, low=None, high=None, side="both"):
+        """
+        Keeps the games where the rating of side ("white", "black" or "both" players) is in [low, high].
+        """
+        columns = RATING_SIDES[side]
+
+        def in_range(df):
+            mask = np.ones(len(df), dtype=bool)
+            for column in columns:
+                ratings = df[column].to_numpy()
+                if low is not None:
+                    mask &= ratings >= low
+                if high is not None:
+                    mask &= ratings <= high
+            return mask
+
+        return self.where(columns, in_range)
+
+    def derive(self, name, columns, function):
+        """
+        Adds a column computed by function from a chunk with (at least) columns, to filter, select or group by.
+        """
+        return self._with(_derived={**self._derived, name: (list(columns), function)})
+
+    def select(self, *columns):
+        return self._with(_columns=list(columns))
+
+    def _source_columns(self, columns):
+        # The raw columns needed to produce the given (raw or derived) columns
+        source = []
+        for column in columns:
+            if column in self._derived:
+                needed = self._source_columns(self._derived[column][0])
+            else:
+                needed = [column]
+            source += [c for c in needed if c not in source]
+        return source
+
+    def _complete(self, df, columns):
+        # Adds the derived columns among columns to a chunk of raw columns
+        for column in columns:
+            if column in self._derived and column not in df:
+                needed, function = self._derived[column]
+                df = self._complete(df, needed)
+                df = df.assign(**{column: function(df)})
+        return df
+
+    def _filter_mask(self, df):
+        mask = np.ones(len(df), dtype=bool)
+        for columns, predicate in self._filters:
+            mask &= predicate(self._complete(df, columns))
+        return mask
+
+    def _iter_store_chunks(self, store, columns, filter_columns):
+        # Reads the filter columns (and ids) of a range of rows, then only the other columns of the matching rows
+        id_codes_seen = np.zeros(len(store.dictionary("id")), dtype=bool)
+        for start in range(0, len(store), self.chunk_size):
+            rows = slice(start, start + self.chunk_size)
+            id_codes = store.column("id")[rows]
+            is_duplicate = id_codes_seen[id_codes] | pd.Series(id_codes).duplicated()
+            id_codes_seen[id_codes] = True
+
+            head = store.read(filter_columns, rows)
+            mask = ~is_duplicate.to_numpy() & self._filter_mask(head)
+            rest = [c for c in columns if c not in filter_columns]
+            matches = start + np.flatnonzero(mask)
+            yield pd.concat([head[mask], store.read(rest, matches)], axis=1)
+
+    def _iter_csv_chunks(self, columns):
+        seen_ids = GameIdIndex()
+        chunks = load_raw_games(
+            self.path, ["id"] + columns, use_store=False, chunksize=self.chunk_size
+        )
+        for chunk in chunks:
+            chunk = drop_duplicate_games(chunk, seen_ids)
+            yield chunk[self._filter_mask(chunk)]
+
+    def iter_chunks(self):
+        """
+        Runs the query, yielding the selected columns of the matching games one chunk at a time.
+        """
+        store = open_game_store(self.path)
+        output_columns = self._columns or (store.columns if store else None)
+        if output_columns is None:
+            output_columns = list(load_raw_games(self.path, nrows=0, use_store=False))
+
+        filter_columns = self._source_columns(
+            [c for columns, _ in self._filters for c in columns]
+        )
+        source_columns = self._source_columns(output_columns)
+        columns = filter_columns + [
+            c for c in source_columns if c not in filter_columns
+        ]
+
+        if store is not None:
+            chunks = self._iter_store_chunks(store, columns, filter_columns)
+        else:
+            chunks = self._iter_csv_chunks([c for c in columns if c != "id"])
+        for chunk in chunks:
+            yield self._complete(chunk, output_columns)[output_columns]
+
+    def collect(self):
+        return pd.concat(list(self.iter_chunks()))
+
+    def count(self):
+        return sum(len(chunk) for chunk in self.select("id").iter_chunks())
+
+    def value_counts(self, column):
+        """
+        Counts the matching games by the values of column, in descending order of count.
+        """
+        counts = [
+            chunk[column].value_counts() for chunk in self.select(column).iter_chunks()
+        ]
+        counts = pd.concat(counts).groupby(level=0, observed=True).sum()
+        return counts[counts > 0].sort_values(ascending=False)
+
+    def group_by(self, *keys):
+        return GroupedGameQuery(self, list(keys))
+
+    def histogram(self, column, bin_width):
+        """
+        Counts the matching games by bins of column of width bin_width, returning a Series indexed by the left
+        edge of each bin.
+        """
+        bins = self.derive(
+            f"{column}_bin",
+            [column],
+            lambda df: np.floor(df[column].to_numpy() / bin_width) * bin_width,
+        )
+        return bins.value_counts(f"{column}_bin").sort_index()
+
+
+class GroupedGameQuery:
+    """
+    A GameQuery grouped by keys, to be aggregated with agg.
+    """
+
+    def __init__(self, query, keys):
+        self.query = query
+        self.keys = keys
+
+    def agg(self, **aggregates):
+        """
+        Aggregates every group, returning a DataFrame indexed by the keys with one column per keyword argument,
+        each either "count" (the number of games) or a (column, function) pair with function one of "count",
+        "sum", "min", "max" or "mean".
+        """
+        aggregates = {
+            name: ("id", "count") if spec == "count" else spec
+            for name, spec in aggregates.items()
+        }
+        # Means are computed from sums and counts, which combine across chunks
+        partials = {}
+        for name, (column, function) in aggregates.items():
+            if function == "mean":
+                partials[f"{name}_sum"] = (column, "sum")
+                partials[f"{name}_count"] = (column, "count")
+            else:
+                partials[name] = (column, function)
+
+        values = {column for column, _ in partials.values()} - set(self.keys)
+        columns = self.keys + sorted(values)
+        chunks = self.query.select(*columns).iter_chunks()
+        combined = pd.concat(
+            [
+                chunk.groupby(self.keys, observed=True).agg(**partials)
+                for chunk in chunks
+            ]
+        )
+        combined = combined.groupby(level=self.keys, observed=True).agg(
+            {name: COMBINE[function] for name, (_, function) in partials.items()}
+        )
+
+        result = pd.DataFrame(index=combined.index)
+        for name, (column, function) in aggregates.items():
+            if function == "mean":
+                result[name] = combined[f"{name}_sum"] / combined[f"{name}_count"]
+            else:
+                result[name] = combined[name]
+        return result
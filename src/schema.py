@@ -0,0 +1,100 @@
+"""
+Source file for the schema sidecar of the design matrix.
+
+scripts/extract_features.py writes "{design matrix}.schema.json" next to every design matrix it builds, which
+records everything the models need to know about it:
+* every column, in file order, with the dtype it is stored as and the feature group it belongs to
+* how the ECO truncations are encoded, and the ECO vocabularies their one-hot columns or codes index into
+* the constants the raw values were normalized with
+
+Models select their features by group with schema_columns, and then read only those columns from disk, so the
+features they use always match the design matrix they are trained on, whatever the ECO vocabulary.
+"""
+
+import json
+
+from src.design_matrix import TIME_COMPONENT_COLUMNS
+from src.player_history import PLAYER_HISTORY_COLUMNS
+
+SCHEMA_VERSION = 1
+
+# Every column belongs to one of these groups, or to "eco" if it is an ECO one-hot or code column
+FEATURE_GROUPS = {
+    "rated": ["rated"],
+    "ratings": ["white_rating", "black_rating", "white_rating_advantage"],
+    "time_limit": ["approx_time_limit_hours"],
+    "time_of_play": TIME_COMPONENT_COLUMNS,
+    "player_history": PLAYER_HISTORY_COLUMNS,
+    "target": ["outcome", "is_draw"],
+}
+ECO_GROUP = "eco"
+
+
+def schema_path(design_matrix_path):
+    return f"{design_matrix_path}.schema.json"
+
+
+def column_group(name):
+    for group, columns in FEATURE_GROUPS.items():
+        if name in columns:
+            return group
+    if name.startswith("eco_"):
+        return ECO_GROUP
+    raise ValueError(f"{name} is not a design matrix column")
+
+
+def design_matrix_schema(columns, eco_vocabularies, eco_encoding, normalization):
+    """
+    Builds the schema of a design matrix from its (name, stored dtype) columns.
+    """
+    return {
+        "version": SCHEMA_VERSION,
+        "columns": [
+            {"name": name, "dtype": str(dtype), "group": column_group(name)}
+            for name, dtype in columns
+        ],
+        "eco_encoding": eco_encoding,
+        "eco_vocabularies": {
+            str(chars): codes for chars, codes in sorted(eco_vocabularies.items())
+        },
+        "normalization": normalization,
+    }
+
+
+def save_schema(schema, design_matrix_path):
+    with open(schema_path(design_matrix_path), "w") as f:
+        json.dump(schema, f, indent=2)
+
+
+def load_schema(design_matrix_path):
+    path = schema_path(design_matrix_path)
+    try:
+        with open(path) as f:
+            schema = json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"{path} not found, rebuild {design_matrix_path} with scripts/extract_features.py"
+        ) from None
+
+    if schema.get("version") != SCHEMA_VERSION:
+        raise ValueError(f"{path} has an unsupported schema version")
+    return schema
+
+
+def schema_columns(schema, groups):
+    """
+    Returns the names of the columns in any of groups, in file order.
+    """
+    unknown = set(groups) - set(FEATURE_GROUPS) - {ECO_GROUP}
+    if unknown:
+        raise ValueError(f"unknown feature groups {sorted(unknown)}")
+    return [c["name"] for c in schema["columns"] if c["group"] in groups]
+
+
+def schema_dtypes(schema):
+    return {c["name"]: c["dtype"] for c in schema["columns"]}
+
+
+def schema_eco_vocabularies(schema):
+    # Vocabularies are keyed by the number of characters kept from the ECO code, as in load_eco_vocabulary
+    return {int(chars): codes for chars, codes in schema["eco_vocabularies"].items()}
@@ -0,0 +1,112 @@
+"""
+Source file for decoding the created_at and last_move_at timestamps of the raw games.
+
+The timestamps are milliseconds since the Unix epoch, which the raw exports write as floats in the format
+"{1.5f}E+12" (e.g. "1.50421E+12"), so they carry 10**7 ms (about 3 hours) of precision at best (see
+duration_analysis.py). decode_timestamps converts such a column once into int64 milliseconds, from which
+time_components and game_durations then compute the month, weekday, hour and duration with integer arithmetic,
+rather than by building datetimes and going through the .dt accessors for every feature.
+
+timestamp_granularity detects the precision of a whole column, and is_low_precision flags the timestamps that
+are too coarse to tell games apart by their duration or hour.
+"""
+
+import numpy as np
+
+MS_PER_SECOND = 1000
+MS_PER_HOUR = 60 * 60 * MS_PER_SECOND
+MS_PER_DAY = 24 * MS_PER_HOUR
+# 1970-01-01 was a Thursday, which is day 3 when Monday is day 0 (as in .dt.dayofweek)
+EPOCH_DAY_OF_WEEK = 3
+# Timestamps rounded to 10**6 ms (about 17 minutes) or coarser can't resolve the duration of most games
+LOW_PRECISION_MS = 10**6
+MAX_GRANULARITY_MS = 10**12
+
+
+def decode_timestamps(values):
+    """
+    Takes a sequence of epoch timestamps in milliseconds (floats as in the raw games, or integers), and returns
+    them as an int64 array. Integer arrays are returned as they are, so decoding twice costs nothing.
+    """
+    values = np.asarray(values)
+    if values.dtype == np.int64:
+        return values
+    values = values.astype(np.float64)
+    if np.isnan(values).any():
+        raise ValueError("Timestamps can't be missing")
+    return np.rint(values).astype(np.int64)
+
+
+def _months(days):
+    # Month (1 to 12) of days since the epoch, by the proleptic Gregorian calendar (Hinnant's civil_from_days)
+    # Shifts the epoch to 0000-03-01, so leap days fall at the end of the (March to February) year
+    days = days + 719468
+    day_of_era = days - days // 146097 * 146097
+    year_of_era = (
+        day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096
+    ) // 365
+    day_of_year = day_of_era - (
+        365 * year_of_era + year_of_era // 4 - year_of_era // 100
+    )
+    # Months from March, of 31, 30, 31, 30, 31 days repeating
+    month = (5 * day_of_year + 2) // 153
+    return np.where(month < 10, month + 3, month - 9)
+
+
+def time_components(timestamps):
+    """
+    Takes decoded timestamps, and returns their month of year (1 to 12), day of week (0 for Monday to 6) and
+    hour of day, in UTC, as int32 arrays the same as pd.to_datetime(unit="ms") and the .dt accessors give.
+    """
+    timestamps = decode_timestamps(timestamps)
+    # Floor division, so timestamps before the epoch fall on the day they belong to
+    days = timestamps // MS_PER_DAY
+    if len(days) == 0:
+        return {
+            column: np.empty(0, dtype=np.int32)
+            for column in ["month_of_year", "day_of_week", "hour_of_day"]
+        }
+
+    # Games usually span far fewer days than there are games, so months are computed once per day and looked up
+    # A longer span (e.g. from one corrupt timestamp) would make the table larger than the games, so the months
+    # of the games are then computed directly
+    first_day = days.min()
+    span = days.max() - first_day + 1
+    if span <= len(days):
+        months = _months(np.arange(first_day, first_day + span))[days - first_day]
+    else:
+        months = _months(days)
+    return {
+        "month_of_year": months.astype(np.int32),
+        "day_of_week": ((days + EPOCH_DAY_OF_WEEK) % 7).astype(np.int32),
+        "hour_of_day": ((timestamps - days * MS_PER_DAY) // MS_PER_HOUR).astype(
+            np.int32
+        ),
+    }
+
+
+def game_durations(created_at, last_move_at):
+    """
+    Takes decoded creation and last move timestamps, and returns the game durations in seconds.
+    """
+    milliseconds = decode_timestamps(last_move_at) - decode_timestamps(created_at)
+    return milliseconds / MS_PER_SECOND
+
+
+def timestamp_granularity(timestamps):
+    """
+    Returns the largest power of ten (in milliseconds, up to 10**12) that divides every one of timestamps.
+    """
+    divisor = int(np.gcd.reduce(decode_timestamps(timestamps), initial=0))
+    granularity = 1
+    while granularity < MAX_GRANULARITY_MS and divisor % (granularity * 10) == 0:
+        granularity *= 10
+    return granularity
+
+
+def is_low_precision(timestamps, precision_ms=LOW_PRECISION_MS):
+    """
+    Flags the timestamps that are multiples of precision_ms, i.e. were most likely rounded to it. A precise
+    timestamp is only one by chance, with a probability of 1 / precision_ms.
+    """
+    return decode_timestamps(timestamps) % precision_ms == 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier
+
+from src.design_matrix import cap_eco_codes
+
+
+def _vocabulary(size):
+    # Sorted truncated codes followed by "other", as fit_eco_vocabulary returns them
+    return [f"A{i:03d}" for i in range(size - 1)] + ["other"]
+
+
+def test_cap_eco_codes_folds_rare_codes_into_other():
+    vocabulary = _vocabulary(300)
+    rng = np.random.default_rng(0)
+    # Code i appears i + 1 times, so the 254 most frequent codes are the last ones before "other"
+    codes = np.repeat(np.arange(299), np.arange(1, 300)).astype(np.int16)
+    codes = np.concatenate([codes, [299, -1]]).astype(np.int16)
+    rng.shuffle(codes)
+    df = pd.DataFrame({"eco_3": codes, "eco_1": np.zeros(len(codes), np.int16)})
+
+    capped, vocabularies = cap_eco_codes(df, {1: ["A", "other"], 3: vocabulary}, 255)
+
+    assert vocabularies[1] == ["A", "other"]
+    assert len(vocabularies[3]) == 255
+    assert vocabularies[3] == vocabulary[45:299] + ["other"]
+    original = np.array(vocabulary + ["missing"])[df["eco_3"].to_numpy()]
+    remapped = np.array(vocabularies[3] + ["missing"])[capped["eco_3"].to_numpy()]
+    kept = np.isin(original, vocabularies[3] + ["missing"])
+    expected = np.where(kept, original, "other")
+    assert (remapped == expected).all()
+    assert capped["eco_3"].dtype == np.int16
+    assert (df["eco_3"].to_numpy() == codes).all()
+
+
+def test_capped_codes_fit_hist_gradient_boosting():
+    vocabulary = _vocabulary(300)
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, len(vocabulary), 5000).astype(np.int16)
+    df = pd.DataFrame({"eco_3": codes, "rating": rng.normal(size=len(codes))})
+    y = codes % 2
+
+    capped, _ = cap_eco_codes(df, {3: vocabulary}, 255)
+
+    model = HistGradientBoostingClassifier(categorical_features=["eco_3"], max_iter=5)
+    model.fit(capped, y)
+    assert model.predict(capped).shape == y.shape
@@ -0,0 +1,21 @@
+import numpy as np
+
+from scripts.duration_analysis import MAX_GAME_TIME_LIMIT_MINUTES
+from scripts.extract_features import extract_features
+from scripts.position_analysis import CUTOFF
+from src.loading import RAW_GAMES_PATH, load_raw_games
+from src.pipeline import FeaturePipeline
+
+
+def test_transform_record_matches_extract_features():
+    df = load_raw_games(RAW_GAMES_PATH, nrows=2000)
+    pipeline = FeaturePipeline.fit(df, CUTOFF, MAX_GAME_TIME_LIMIT_MINUTES)
+
+    design_matrix = extract_features(df, pipeline.eco_vocabularies)
+    expected = design_matrix.drop(columns=["outcome", "is_draw"])
+    assert pipeline.feature_names == list(expected.columns)
+
+    records = df.to_dict("records")
+    rows = np.array([pipeline.transform_record(record) for record in records])
+    np.testing.assert_allclose(rows, expected.to_numpy(dtype=np.float64))
+    np.testing.assert_allclose(pipeline.transform_records(records), rows)